@@ -1,9 +1,13 @@
 from .math_agent import create_math_agent, create_math_task
 from .philosophy_agent import create_philosophy_agent, create_philosophy_task
 from .society_agent import create_society_agent, create_society_task
+from .registry import Section, SECTIONS, register_section, sections_by_slot
+from .schema import SectionOutput, parse_section_output, to_markdown
 
 __all__ = [
     'create_math_agent', 'create_math_task',
     'create_philosophy_agent', 'create_philosophy_task',
     'create_society_agent', 'create_society_task',
+    'Section', 'SECTIONS', 'register_section', 'sections_by_slot',
+    'SectionOutput', 'parse_section_output', 'to_markdown',
 ]
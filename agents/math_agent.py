@@ -7,6 +7,7 @@ Nivå: Grundkurser vid universitet (Introductory university level).
 from crewai import Agent, Task, LLM
 from typing import List
 import config
+from .schema import STRUCTURED_INSTRUCTIONS, STRUCTURED_EXPECTED_OUTPUT
 
 
 # Pool of topics focused on introductory university courses
@@ -72,11 +73,11 @@ def create_math_agent(llm: LLM) -> Agent:
             "Dessa kommer att renderas som bilder i mailet, så var noga med att syntaxen är korrekt."
         ),
         llm=llm,
-        verbose=True,
+        verbose=config.CREW_VERBOSE,
     )
 
 
-def create_math_task(agent: Agent, used_topics: List[str]) -> Task:
+def create_math_task(agent: Agent, used_topics: List[str], structured: bool = False) -> Task:
     used_str = "\n".join(f"- {t}" for t in used_topics) if used_topics else "Inga ännu."
 
     return Task(
@@ -93,15 +94,17 @@ def create_math_task(agent: Agent, used_topics: List[str]) -> Task:
             "- Presentera centrala formler i fristående block med $$ [latex] $$\n"
             "- Gå igenom ett konkret exempel eller ett beräkningssteg\n"
             "- Lyft en vanlig fallgrop eller ett viktigt observation\n"
-            "- Avsluta med en kort koppling till nästa steg i ämnet\n\n"
+            f"- Avsluta under rubriken ### {config.SECTION_CLOSING_HEADING} med en kort koppling till nästa steg i ämnet\n\n"
             "FORMAT-REGLER:\n"
             "- Använd inline-latex ($...$) för enskilda variabler och korta uttryck i löptext. \n"
             "- Använd $$...$$ ENDAST för större, fristående formler på egna rader.\n"
             "LÄNGD: 500 ord (viktigt).\n"
             "TON: Pedagogisk, tydlig, på introducerande universitetsnivå (grundkurs)."
+            + (STRUCTURED_INSTRUCTIONS if structured else "")
         ),
         agent=agent,
         expected_output=(
+            STRUCTURED_EXPECTED_OUTPUT if structured else
             "En 500-ords repetitionstext på svenska med korrekt LaTeX-notation inom $$ ... $$ för formler."
         ),
     )
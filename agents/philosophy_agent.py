@@ -6,6 +6,7 @@ Filosofi & Logik agent.
 from crewai import Agent, Task, LLM
 from typing import List
 import config
+from .schema import STRUCTURED_INSTRUCTIONS, STRUCTURED_EXPECTED_OUTPUT
 
 
 PHILOSOPHY_TOPIC_POOL = [
@@ -71,11 +72,11 @@ def create_philosophy_agent(llm: LLM) -> Agent:
             "Dessa renderas som bilder i mailet."
         ),
         llm=llm,
-        verbose=True,
+        verbose=config.CREW_VERBOSE,
     )
 
 
-def create_philosophy_task(agent: Agent, used_topics: List[str]) -> Task:
+def create_philosophy_task(agent: Agent, used_topics: List[str], structured: bool = False) -> Task:
     used_str = "\n".join(f"- {t}" for t in used_topics) if used_topics else "Inga ännu."
 
     return Task(
@@ -91,16 +92,18 @@ def create_philosophy_task(agent: Agent, used_topics: List[str]) -> Task:
             "- Exponera argumentets logiska struktur (P1, P2... C) i block med $$ [latex] $$\n"
             "- Redovisa minst en invändning och svaret på den\n"
             "- Om tillämpligt: koppla till en angränsande tes eller sats\n"
-            "- Avsluta med en öppen fråga som driver vidare reflektion\n\n"
+            f"- Avsluta under rubriken ### {config.SECTION_CLOSING_HEADING} med en öppen fråga som driver vidare reflektion\n\n"
             "FORMAT-REGLER:\n"
             "- Använd inline-latex ($...$) för enskilda variabler och korta uttryck i löptext. \n"
             "- Använd $$...$$ ENDAST för större, fristående formler på egna rader.\n"
             "- Använd standard LaTeX-symboler som \\wedge, \\vee, \\neg, \\rightarrow, \\forall, \\exists.\n"
             "LÄNGD: 500 ord.\n"
             "TON: Analytisk, precis, universitetsanpassad."
+            + (STRUCTURED_INSTRUCTIONS if structured else "")
         ),
         agent=agent,
         expected_output=(
+            STRUCTURED_EXPECTED_OUTPUT if structured else
             "En 500-ords repetitionstext på svenska med logisk struktur i LaTeX-notation inom $$ ... $$."
         ),
     )
@@ -0,0 +1,64 @@
+"""
+Section registry.
+Each email section declares its agent/task factories, the DB category its topics are
+logged under and how it is presented in the template. The orchestrator in main.py
+generates every registered section, so adding a domain only means adding an entry here.
+"""
+
+from dataclasses import dataclass
+from typing import Callable, Iterable, List, Optional
+
+from .math_agent import create_math_agent, create_math_task
+from .philosophy_agent import create_philosophy_agent, create_philosophy_task
+from .society_agent import create_society_agent, create_society_task
+
+
+@dataclass(frozen=True)
+class Section:
+    category: str               # DB category, e.g. 'math'
+    label: str                  # short id for logs and image file names (no underscores)
+    create_agent: Callable      # (llm) -> Agent
+    create_task: Callable       # (agent, used_topics, structured=False) -> Task
+    title: str                  # heading shown above the topic (HTML-escaped)
+    icon: str
+    color: str                  # heading/icon colour, e.g. '#0369a1'
+    tint: str                   # icon background as 'r,g,b'
+    slot: int                   # position in the email, lowest first
+    in_subject: bool = True     # include the topic in the subject line
+    target_words: int = 500     # length the task asks for; the floor of its token budget
+
+
+SECTIONS: List[Section] = []
+
+
+def register_section(section: Section):
+    if any(s.category == section.category for s in SECTIONS):
+        raise ValueError(f"Section {section.category!r} is already registered")
+    if '_' in section.label:
+        raise ValueError(f"Section label {section.label!r} must not contain underscores")
+    SECTIONS.append(section)
+
+
+def sections_by_slot(sections: Optional[Iterable[Section]] = None) -> List[Section]:
+    """`sections` (default: every registered section) in email order."""
+    return sorted(SECTIONS if sections is None else sections, key=lambda s: s.slot)
+
+
+register_section(Section(
+    category='math', label='math',
+    create_agent=create_math_agent, create_task=create_math_task,
+    title='Matematik &amp; Datalogi', icon='∑',
+    color='#0369a1', tint='79,172,254', slot=2,
+))
+register_section(Section(
+    category='philosophy', label='phil',
+    create_agent=create_philosophy_agent, create_task=create_philosophy_task,
+    title='Filosofi &amp; Logik', icon='φ',
+    color='#6d28d9', tint='167,139,250', slot=1,
+))
+register_section(Section(
+    category='society', label='soc',
+    create_agent=create_society_agent, create_task=create_society_task,
+    title='Samhälle &amp; Historia', icon='⚖',
+    color='#059669', tint='52,211,153', slot=0, in_subject=False,
+))
@@ -0,0 +1,108 @@
+"""
+Structured section output.
+In structured mode (config.STRUCTURED_OUTPUT) each agent answers with JSON: the topic,
+the text as ordered blocks and a table of every formula. Formulas can then be rendered
+straight from the table, and the blocks turned into HTML without scanning for $…$.
+"""
+
+import re
+from typing import List, Literal
+
+from pydantic import BaseModel, model_validator
+
+# Inline formula reference inside block text, e.g. "där [[f2]] är gradienten"
+FORMULA_REF = re.compile(r'\[\[([A-Za-z0-9]+)\]\]')
+
+STRUCTURED_INSTRUCTIONS = (
+    "\n\nSVARSFORMAT (ersätter TOPIC-raden och markdown-formatet ovan):\n"
+    "Svara ENBART med ett JSON-objekt med fälten:\n"
+    '- "topic": ämnesnamnet.\n'
+    '- "blocks": textens block i ordning. Varje block är {"type": ..., ...} där type är '
+    '"heading" (med "text" och "level" 2 eller 3), "paragraph" eller "quote" (med "text"), '
+    '"list" (med "items") eller "formula" (med "formula": ett formel-id).\n'
+    '- "formulas": alla formler i den ordning de förekommer, '
+    'vardera {"id": "f1", "latex": "...", "display": true för fristående formler, annars false}.\n'
+    "I löptext refererar du till en inline-formel med [[id]] i stället för $...$. "
+    "En formel med display true används bara som formula-block, en med display false bara "
+    "som [[id]] i text, och varje formel i listan ska användas. "
+    "Dollartecken i texten är vanlig text. Fetstil (**...**) och kursiv (*...*) är tillåtna."
+)
+STRUCTURED_EXPECTED_OUTPUT = "Ett JSON-objekt enligt SVARSFORMAT, utan annan text."
+
+
+class Formula(BaseModel):
+    id: str
+    latex: str
+    display: bool = False
+
+
+class Block(BaseModel):
+    type: Literal['heading', 'paragraph', 'list', 'quote', 'formula']
+    text: str = ''
+    level: int = 2
+    items: List[str] = []
+    formula: str = ''
+
+
+class SectionOutput(BaseModel):
+    topic: str
+    blocks: List[Block]
+    formulas: List[Formula] = []
+
+    @model_validator(mode='after')
+    def _check_references(self):
+        """
+        Every reference must name a formula placed the way it is drawn: display formulas
+        only as formula blocks (a <div> inside a <p> otherwise), inline ones only as [[id]]
+        in text. Formulas nobody references are dropped – they would be rendered and
+        attached for nothing.
+        """
+        display = {f.id: f.display for f in self.formulas}
+        used = set()
+        for block in self.blocks:
+            refs = [(r, False) for r in FORMULA_REF.findall(' '.join([block.text, *block.items]))]
+            if block.type == 'formula':
+                refs.append((block.formula, True))
+            missing = [r for r, _ in refs if r not in display]
+            if missing:
+                raise ValueError(f"unknown formula id(s): {', '.join(missing)}")
+            misplaced = [r for r, as_block in refs if display[r] != as_block]
+            if misplaced:
+                raise ValueError(
+                    f"formula(s) {', '.join(misplaced)} placed as "
+                    f"{'a formula block' if block.type == 'formula' else 'inline references'} "
+                    f"but declared {'inline' if block.type == 'formula' else 'display'}"
+                )
+            used.update(r for r, _ in refs)
+        self.formulas = [f for f in self.formulas if f.id in used]
+        return self
+
+
+def parse_section_output(raw: str) -> SectionOutput:
+    """Parse an agent's JSON answer, tolerating code fences or text around the object."""
+    match = re.search(r'\{.*\}', raw, flags=re.DOTALL)
+    if not match:
+        raise ValueError("no JSON object in structured output")
+    return SectionOutput.model_validate_json(match.group(0))
+
+
+def to_markdown(section: SectionOutput) -> str:
+    """The same section in the free-form markdown format the agents use by default."""
+    latex = {f.id: f.latex for f in section.formulas}
+
+    def _text(s: str) -> str:
+        return FORMULA_REF.sub(lambda m: f"${latex[m.group(1)]}$", s)
+
+    parts = [f"TOPIC: {section.topic}"]
+    for block in section.blocks:
+        if block.type == 'heading':
+            parts.append(f"{'#' * block.level} {_text(block.text)}")
+        elif block.type == 'paragraph':
+            parts.append(_text(block.text))
+        elif block.type == 'quote':
+            parts.append(f"> {_text(block.text)}")
+        elif block.type == 'list':
+            parts.append('\n'.join(f"- {_text(item)}" for item in block.items))
+        elif block.type == 'formula':
+            parts.append(f"$${latex[block.formula]}$$")
+    return '\n\n'.join(parts)
@@ -6,6 +6,7 @@ Samhälle & Historia agent.
 from crewai import Agent, Task, LLM
 from typing import List
 import config
+from .schema import STRUCTURED_INSTRUCTIONS, STRUCTURED_EXPECTED_OUTPUT
 
 
 SOCIETY_TOPIC_POOL = [
@@ -70,11 +71,11 @@ def create_society_agent(llm: LLM) -> Agent:
             "LaTeX-notation inom $$ ... $$. Dessa renderas som bilder i mailet."
         ),
         llm=llm,
-        verbose=True,
+        verbose=config.CREW_VERBOSE,
     )
 
 
-def create_society_task(agent: Agent, used_topics: List[str]) -> Task:
+def create_society_task(agent: Agent, used_topics: List[str], structured: bool = False) -> Task:
     used_str = "\n".join(f"- {t}" for t in used_topics) if used_topics else "Inga ännu."
 
     return Task(
@@ -91,15 +92,17 @@ def create_society_task(agent: Agent, used_topics: List[str]) -> Task:
             "- Använd standard LaTeX-symboler som \\geq, \\leq, \\neq, \\approx.\n"
             "- Ge minst ett historiskt eller empiriskt exempel som belyser teorin\n"
             "- Diskutera en invändning eller ett alternativt perspektiv\n"
-            "- Koppla till ett angränsande ämne i avslutningen\n\n"
+            f"- Avsluta under rubriken ### {config.SECTION_CLOSING_HEADING} med en koppling till ett angränsande ämne\n\n"
             "FORMAT-REGLER:\n"
             "- Använd inline-latex ($...$) för enskilda variabler och korta uttryck i löptext. \n"
             "- Använd $$...$$ ENDAST för större, fristående formler på egna rader.\n"
             "LÄNGD: 500 ord.\n"
             "TON: Institutionell, analytisk, saklig."
+            + (STRUCTURED_INSTRUCTIONS if structured else "")
         ),
         agent=agent,
         expected_output=(
+            STRUCTURED_EXPECTED_OUTPUT if structured else
             "En 500-ords repetitionstext på svenska med tekniska uttryck i LaTeX inom $$ ... $$."
         ),
     )
@@ -27,21 +27,102 @@ OPENAI_API_KEY    = os.getenv('OPENAI_API_KEY', 'dummy')  # CrewAI requires it
 PROJECT_ROOT = Path(__file__).parent
 DATABASE_PATH = PROJECT_ROOT / 'topics.db'
 TEMPLATE_DIR  = PROJECT_ROOT / 'templates'
+SAMPLES_DIR   = PROJECT_ROOT / 'samples' / 'sections'   # shared sample sections (JSON)
 LOG_DIR       = PROJECT_ROOT / 'logs'
+RENDER_DIR    = LOG_DIR / 'render'      # formula PNGs, one sub-directory per send date
 
 LOG_DIR.mkdir(exist_ok=True)
 
+# Logging (utils/log_setup.py) – the file log is JSON lines, rotated at LOG_MAX_BYTES
+LOG_MAX_BYTES = 2 * 1024 * 1024
+LOG_BACKUPS   = 3
+LOG_KEEP_DAYS = 14        # render directories and previews in LOG_DIR older than this are deleted
+# Level per subsystem (logger name, '' is the root). Override with LOG_LEVELS="crew=DEBUG,httpx=INFO".
+# The 'crew' logger writes one summary per crew at INFO and the full answer at DEBUG.
+LOG_LEVELS = {
+    '':       'INFO',
+    'crew':   'INFO',
+    'httpx':  'WARNING',
+    'LiteLLM': 'WARNING',
+}
+CREW_VERBOSE = False      # crewai's own step-by-step transcripts on stdout, for local debugging
+
 # LLM model
 LLM_MODEL = "anthropic/claude-opus-4-6"
 
+# LaTeX rendering – limits per formula, enforced in an isolated worker process
+LATEX_USETEX_TIMEOUT   = 20     # seconds, latex + dvipng
+LATEX_MATHTEXT_TIMEOUT = 10     # seconds
+LATEX_MEMORY_MB        = 1024   # address-space cap for the worker and its children
+LATEX_MAX_CHARS        = 1500
+LATEX_MAX_DEPTH        = 20     # max brace nesting
+LATEX_MAX_WORKERS      = 4      # worker processes alive at once, across all threads
+LATEX_WORKER_MAX_JOBS  = 200    # formulas per worker process before it is replaced
+LATEX_START_TIMEOUT    = 60     # seconds for a new worker process to import matplotlib
+LATEX_RENDER_THREADS   = 4      # formulas of one section rendered concurrently
+
+# Caches that make a run's first formula as cheap as its last – persist CACHE_DIR between runs
+CACHE_DIR         = Path(os.getenv('REPETITIONSMAIL_CACHE_DIR', PROJECT_ROOT / '.cache'))
+MPL_CACHE_DIR     = CACHE_DIR / 'matplotlib'   # font list and usetex output (MPLCONFIGDIR)
+TEXMF_CACHE_DIR   = CACHE_DIR / 'texmf-var'    # fonts/formats generated by TeX (TEXMFVAR)
+FORMULA_CACHE_DIR = CACHE_DIR / 'formulas'     # rendered PNGs, keyed by LaTeX, backend and preamble
+WARM_FORMULAS     = 50     # most-used formulas from history pre-rendered by `main.py --warm`
+
+# Client-side limits shared by every LLM call (utils/llm_limiter.py). Set them to the
+# organisation's Anthropic rate limits for LLM_MODEL; defaults are tier 2 for Opus.
+LLM_REQUESTS_PER_MINUTE      = 1000
+LLM_INPUT_TOKENS_PER_MINUTE  = 450_000
+LLM_OUTPUT_TOKENS_PER_MINUTE = 90_000   # reserved per request as max_tokens, corrected after
+LLM_CONCURRENCY_START = 4      # AIMD: grows by 1 per window of successes, halves on 429/529
+LLM_CONCURRENCY_MAX   = 8
+LLM_MAX_RETRIES       = 4      # throttled requests retried after retry-after, then the error is raised
+
+# Hedged generation – a section still running after this percentile of its recent
+# generation times gets a second, identical request; the first answer wins
+HEDGE_PERCENTILE  = 90
+HEDGE_HISTORY     = 30     # recent generation times per section used for the percentile
+HEDGE_MIN_SAMPLES = 5      # no hedging for a section until it has this many
+HEDGE_BUDGET      = 2      # hedged requests per process (one run or one `generate`)
+
+# Length control (utils/length_control.py) – max_tokens per section from its history, and
+# streamed answers cut once they reach the target length and close under this heading
+SECTION_CLOSING_HEADING   = 'Avslutning'
+LENGTH_DEFAULT_MAX_TOKENS = 4096   # budget until a section has LENGTH_MIN_SAMPLES measured runs (and the cap)
+LENGTH_MIN_SAMPLES        = 5
+LENGTH_HISTORY            = 30
+LENGTH_HEADROOM           = 1.3    # over p90 words × median tokens/word, so answers are not truncated
+LENGTH_OVERHEAD_TOKENS    = 150    # crewai's Thought/Final Answer framing and the TOPIC line
+LENGTH_MIN_TOKENS         = 800
+
+# Agents answer with JSON (topic, blocks, formula table) instead of markdown – see agents/schema.py
+STRUCTURED_OUTPUT = False
+
+# Repair of formulas that failed to render (one batched LLM request per section and round)
+FORMULA_REPAIR_ATTEMPTS   = 2
+FORMULA_REPAIR_MAX_TOKENS = 512
+FORMULA_REPAIR_DEADLINE   = 60   # seconds per section for every repair round (requests and re-renders)
+
+# Sections generated concurrently per email (see agents/registry.py)
+MAX_PARALLEL_SECTIONS  = 4
+
+# Gmail clips HTML bodies larger than ~102 KB
+GMAIL_CLIP_BYTES       = 102 * 1024
+GMAIL_CLIP_WARN_RATIO  = 0.85   # warn from this share of the limit
+
+# Pre-generation queue (main.py generate / send-due)
+GENERATE_PARALLEL_DAYS = 3      # days generated concurrently
+TOPIC_RESERVE_ATTEMPTS = 2      # regenerations when another queued day took the same topic
+RESERVATION_TTL_HOURS  = 6      # a reservation no queued message carries stops counting after this
+
 
-def validate_config() -> bool:
+def validate_config(require_llm: bool = True) -> bool:
     required = {
-        'ANTHROPIC_API_KEY': ANTHROPIC_API_KEY,
         'GMAIL_SENDER':      GMAIL_SENDER,
         'GMAIL_APP_PASSWORD':GMAIL_APP_PASSWORD,
         'GMAIL_RECIPIENT':   GMAIL_RECIPIENT,
     }
+    if require_llm:
+        required['ANTHROPIC_API_KEY'] = ANTHROPIC_API_KEY
     missing = [k for k, v in required.items() if not v]
     if missing:
         logger.error(f"Missing config: {', '.join(missing)}")
@@ -3,6 +3,7 @@ SQLite database for tracking sent topics.
 Prevents repetition and enables progressive deepening.
 """
 
+import uuid
 import sqlite3
 import logging
 from datetime import datetime, timedelta, timezone
@@ -22,8 +23,62 @@ CREATE TABLE IF NOT EXISTS sent_topics (
 
 CREATE INDEX IF NOT EXISTS idx_category ON sent_topics(category);
 CREATE INDEX IF NOT EXISTS idx_sent_at  ON sent_topics(sent_at);
+
+-- Topics picked for a generated but not yet sent email
+CREATE TABLE IF NOT EXISTS reserved_topics (
+    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+    category    TEXT    NOT NULL,
+    topic       TEXT    NOT NULL,
+    send_date   TEXT    NOT NULL,  -- YYYY-MM-DD the email is scheduled for
+    reserved_at TEXT    NOT NULL,  -- ISO-8601
+    batch       TEXT    NOT NULL   -- the generation that reserved it (new_batch())
+);
+
+CREATE INDEX IF NOT EXISTS idx_reserved_date ON reserved_topics(send_date);
+
+-- Finished MIME messages waiting for their send date
+CREATE TABLE IF NOT EXISTS outbox (
+    id         INTEGER PRIMARY KEY AUTOINCREMENT,
+    send_date  TEXT    NOT NULL UNIQUE,  -- YYYY-MM-DD
+    subject    TEXT    NOT NULL,
+    message    BLOB    NOT NULL,         -- RFC 822 bytes, ready for SMTP
+    created_at TEXT    NOT NULL,
+    batch      TEXT    NOT NULL          -- the generation whose reservations it carries
+);
+
+-- How often each formula has been generated; `main.py --warm` pre-renders the most common
+CREATE TABLE IF NOT EXISTS formula_usage (
+    latex     TEXT    NOT NULL,
+    inline    INTEGER NOT NULL,      -- 1 for $...$, 0 for $$...$$
+    uses      INTEGER NOT NULL,
+    last_used TEXT    NOT NULL,      -- ISO-8601
+    PRIMARY KEY (latex, inline)
+);
+
+-- Every section generation: wall time for the hedging percentile, length for the token budget
+CREATE TABLE IF NOT EXISTS generation_times (
+    id            INTEGER PRIMARY KEY AUTOINCREMENT,
+    category      TEXT    NOT NULL,
+    seconds       REAL    NOT NULL,
+    finished_at   TEXT    NOT NULL,  -- ISO-8601
+    words         INTEGER,           -- words in the answer
+    output_tokens INTEGER,           -- NULL when unknown (e.g. a stream stopped early)
+    max_tokens    INTEGER            -- the budget the request had
+);
+
+CREATE INDEX IF NOT EXISTS idx_generation_category ON generation_times(category, finished_at);
 """
 
+# A reservation counts while its message is in the outbox, or for this long while it is
+# being generated – rows left behind by a killed generator stop blocking their topics
+LIVE_RESERVATION = (
+    "(batch IN (SELECT batch FROM outbox) OR reserved_at >= ?)"
+)
+
+def new_batch() -> str:
+    """Id for one generation of one email; its topic reservations are tagged with it."""
+    return uuid.uuid4().hex
+
 
 class TopicDatabase:
     def __init__(self, db_path: Path = config.DATABASE_PATH):
@@ -40,16 +95,29 @@ class TopicDatabase:
             conn.executescript(SCHEMA)
         logger.info(f"Database ready at {self.db_path}")
 
+    @staticmethod
+    def _live_cutoff() -> str:
+        return (datetime.now(timezone.utc) - timedelta(hours=config.RESERVATION_TTL_HOURS)).isoformat()
+
     def get_recent_topics(self, category: str, days: int = 60) -> List[str]:
-        """Return topics used in the last `days` days for a given category."""
+        """
+        Return topics used in the last `days` days for a given category,
+        including topics reserved for queued emails that have not been sent yet.
+        """
         cutoff = (datetime.now(timezone.utc) - timedelta(days=days)).isoformat()
         with self._connect() as conn:
+            reserved = conn.execute(
+                f"SELECT topic FROM reserved_topics WHERE category = ? AND {LIVE_RESERVATION} ORDER BY send_date",
+                (category, self._live_cutoff())
+            ).fetchall()
             rows = conn.execute(
                 "SELECT topic FROM sent_topics WHERE category = ? AND sent_at >= ? ORDER BY sent_at DESC",
                 (category, cutoff)
             ).fetchall()
-        topics = [row['topic'] for row in rows]
-        logger.info(f"[{category}] {len(topics)} recent topics in last {days} days")
+        topics = [row['topic'] for row in reserved] + [row['topic'] for row in rows]
+        logger.info(
+            f"[{category}] {len(topics)} recent topics in last {days} days ({len(reserved)} reserved)"
+        )
         return topics
 
     def log_topic(self, category: str, topic: str):
@@ -62,6 +130,162 @@ class TopicDatabase:
             )
         logger.info(f"[{category}] Logged topic: {topic!r}")
 
+    # ── Topic reservations ──────────────────────────────────────────────────
+    def reserve_topic(self, category: str, topic: str, send_date: str, batch: str,
+                      days: int = 60, force: bool = False) -> bool:
+        """
+        Reserve `topic` for the email scheduled on `send_date`, generated as `batch`.
+        Returns False if the topic is already reserved or was sent in the last `days` days,
+        unless `force` is set. The check and insert run in one write transaction,
+        so parallel generators can't both win.
+        """
+        now = datetime.now(timezone.utc)
+        cutoff = (now - timedelta(days=days)).isoformat()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            taken = not force and conn.execute(
+                f"SELECT 1 FROM reserved_topics WHERE category = ? AND lower(topic) = lower(?) AND {LIVE_RESERVATION} "
+                "UNION ALL "
+                "SELECT 1 FROM sent_topics WHERE category = ? AND lower(topic) = lower(?) AND sent_at >= ?",
+                (category, topic, self._live_cutoff(), category, topic, cutoff)
+            ).fetchone()
+            if taken:
+                logger.info(f"[{category}] Topic already taken: {topic!r}")
+                return False
+            conn.execute(
+                "INSERT INTO reserved_topics (category, topic, send_date, reserved_at, batch) VALUES (?, ?, ?, ?, ?)",
+                (category, topic, send_date, now.isoformat(), batch)
+            )
+        logger.info(f"[{category}] Reserved topic for {send_date}: {topic!r}")
+        return True
+
+    def release_reservations(self, batch: str):
+        """Drop the reservations made by `batch` (generation failed or was a dry run)."""
+        with self._connect() as conn:
+            conn.execute("DELETE FROM reserved_topics WHERE batch = ?", (batch,))
+        logger.info(f"Released topic reservations of batch {batch}")
+
+    def commit_reservations(self, batch: str):
+        """Move the reservations made by `batch` into sent_topics."""
+        now = datetime.now(timezone.utc).isoformat()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO sent_topics (category, topic, sent_at) "
+                "SELECT category, topic, ? FROM reserved_topics WHERE batch = ?",
+                (now, batch)
+            )
+            conn.execute("DELETE FROM reserved_topics WHERE batch = ?", (batch,))
+        logger.info(f"Logged reserved topics of batch {batch}")
+
+    def drop_stale_reservations(self, send_date: str):
+        """
+        Before (re)generating `send_date`: drop its reservations that no queued message
+        carries – leftovers of a generator that was killed or crashed for that day.
+        """
+        with self._connect() as conn:
+            dropped = conn.execute(
+                "DELETE FROM reserved_topics WHERE send_date = ? "
+                "AND batch NOT IN (SELECT batch FROM outbox)",
+                (send_date,)
+            ).rowcount
+        if dropped:
+            logger.warning(f"Dropped {dropped} stale topic reservation(s) for {send_date}")
+
+    # ── Outbox ──────────────────────────────────────────────────────────────
+    def queued_dates(self) -> List[str]:
+        """Send dates that already have a message waiting in the outbox."""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT send_date FROM outbox ORDER BY send_date"
+            ).fetchall()
+        return [row['send_date'] for row in rows]
+
+    def enqueue_message(self, send_date: str, subject: str, message: bytes, batch: str):
+        now = datetime.now(timezone.utc).isoformat()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO outbox (send_date, subject, message, created_at, batch) VALUES (?, ?, ?, ?, ?)",
+                (send_date, subject, message, now, batch)
+            )
+        logger.info(f"Queued email for {send_date}: {subject!r} ({len(message)} bytes)")
+
+    def next_due_message(self, today: str) -> Optional[dict]:
+        """Return the oldest queued message scheduled on or before `today`, if any."""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT * FROM outbox WHERE send_date <= ? ORDER BY send_date LIMIT 1",
+                (today,)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def drop_message(self, message_id: int):
+        """Remove a message from the outbox without sending it and free its topics."""
+        with self._connect() as conn:
+            (batch,) = conn.execute(
+                "SELECT batch FROM outbox WHERE id = ?", (message_id,)
+            ).fetchone()
+            conn.execute("DELETE FROM outbox WHERE id = ?", (message_id,))
+        self.release_reservations(batch)
+
+    def mark_sent(self, message_id: int):
+        """Remove a sent message from the outbox and log the topics reserved for it."""
+        with self._connect() as conn:
+            (batch,) = conn.execute(
+                "SELECT batch FROM outbox WHERE id = ?", (message_id,)
+            ).fetchone()
+            conn.execute("DELETE FROM outbox WHERE id = ?", (message_id,))
+        self.commit_reservations(batch)
+
+    # ── Formula history ─────────────────────────────────────────────────────
+    def record_formulas(self, formulas: List[tuple]):
+        """Count one use of every (latex, inline) formula."""
+        now = datetime.now(timezone.utc).isoformat()
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT INTO formula_usage (latex, inline, uses, last_used) VALUES (?, ?, 1, ?) "
+                "ON CONFLICT (latex, inline) DO UPDATE SET uses = uses + 1, last_used = excluded.last_used",
+                [(latex, int(inline), now) for latex, inline in formulas]
+            )
+
+    def common_formulas(self, limit: int = 50) -> List[tuple]:
+        """The `limit` most used formulas as (latex, inline), most used first."""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT latex, inline FROM formula_usage ORDER BY uses DESC, last_used DESC LIMIT ?",
+                (limit,)
+            ).fetchall()
+        return [(row['latex'], bool(row['inline'])) for row in rows]
+
+    # ── Generation times ────────────────────────────────────────────────────
+    def record_generation_time(self, category: str, seconds: float, words: Optional[int] = None,
+                               output_tokens: Optional[int] = None, max_tokens: Optional[int] = None):
+        now = datetime.now(timezone.utc).isoformat()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO generation_times (category, seconds, finished_at, words, output_tokens, max_tokens) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (category, seconds, now, words, output_tokens, max_tokens)
+            )
+
+    def recent_generation_times(self, category: str, limit: int = 30) -> List[float]:
+        """The last `limit` generation times for `category`, in seconds."""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT seconds FROM generation_times WHERE category = ? ORDER BY finished_at DESC LIMIT ?",
+                (category, limit)
+            ).fetchall()
+        return [row['seconds'] for row in rows]
+
+    def recent_lengths(self, category: str, limit: int = 30) -> List[tuple]:
+        """The last `limit` (words, output_tokens) pairs for `category`; either may be None."""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT words, output_tokens FROM generation_times WHERE category = ? "
+                "ORDER BY finished_at DESC LIMIT ?",
+                (category, limit)
+            ).fetchall()
+        return [(row['words'], row['output_tokens']) for row in rows]
+
     def get_all(self, category: Optional[str] = None) -> List[dict]:
         """Fetch all records, optionally filtered by category."""
         with self._connect() as conn:
@@ -78,11 +302,56 @@ class TopicDatabase:
 
 if __name__ == '__main__':
     import json
-    db = TopicDatabase()
-    # Self-test
-    db.log_topic('math', 'Spektralsatsen – Test')
-    db.log_topic('philosophy', 'Gödels ofullständighetssats – Test')
-    db.log_topic('society', 'Nash-jämvikt – Test')
-    print("All records:")
-    print(json.dumps(db.get_all(), indent=2, ensure_ascii=False))
-    print("Recent math topics:", db.get_recent_topics('math'))
+    import tempfile
+
+    logging.basicConfig(level=logging.INFO)
+    with tempfile.TemporaryDirectory() as tmp:
+        db = TopicDatabase(Path(tmp) / 'selftest.db')
+        # Self-test
+        db.log_topic('math', 'Spektralsatsen – Test')
+        db.log_topic('philosophy', 'Gödels ofullständighetssats – Test')
+        db.log_topic('society', 'Nash-jämvikt – Test')
+        print("All records:")
+        print(json.dumps(db.get_all(), indent=2, ensure_ascii=False))
+        print("Recent math topics:", db.get_recent_topics('math'))
+
+        # Reservations: one generation per batch, committed or released as a whole
+        a, b = new_batch(), new_batch()
+        assert db.reserve_topic('math', 'Fouriertransformen', '2030-01-01', a)
+        assert not db.reserve_topic('math', 'fouriertransformen', '2030-01-02', b), "reserved twice"
+        assert not db.reserve_topic('math', 'Spektralsatsen – Test', '2030-01-02', b), "sent topic reserved"
+        assert db.reserve_topic('math', 'Spektralsatsen – Test', '2030-01-02', b, force=True)
+        db.release_reservations(b)
+        assert 'Spektralsatsen – Test' in db.get_recent_topics('math')
+        assert db.get_recent_topics('math').count('Fouriertransformen') == 1
+
+        # A queued message keeps its reservations; an orphan expires after RESERVATION_TTL_HOURS
+        db.enqueue_message('2030-01-01', 'Ämne', b'message', a)
+        c = new_batch()
+        assert db.reserve_topic('math', 'Laplacetransformen', '2030-01-03', c)
+        expired = (datetime.now(timezone.utc) - timedelta(hours=config.RESERVATION_TTL_HOURS + 1)).isoformat()
+        with db._connect() as conn:
+            conn.execute("UPDATE reserved_topics SET reserved_at = ?", (expired,))
+        recent = db.get_recent_topics('math')
+        assert 'Fouriertransformen' in recent and 'Laplacetransformen' not in recent, recent
+        assert db.reserve_topic('math', 'Laplacetransformen', '2030-01-04', new_batch())
+
+        # Regenerating a day drops its leftovers but never a queued message's reservations
+        d = new_batch()
+        assert db.reserve_topic('math', 'Eulers formel', '2030-01-01', d)
+        db.drop_stale_reservations('2030-01-01')
+        recent = db.get_recent_topics('math')
+        assert 'Fouriertransformen' in recent and 'Eulers formel' not in recent, recent
+
+        # Sending commits the queued message's topics; dropping one frees them
+        message = db.next_due_message('2030-01-01')
+        assert message['batch'] == a
+        db.mark_sent(message['id'])
+        assert db.queued_dates() == []
+        assert [r['topic'] for r in db.get_all('math')].count('Fouriertransformen') == 1
+        e = new_batch()
+        assert db.reserve_topic('math', 'Greens sats', '2030-01-05', e)
+        db.enqueue_message('2030-01-05', 'Ämne', b'message', e)
+        db.drop_message(db.next_due_message('2030-01-05')['id'])
+        assert 'Greens sats' not in db.get_recent_topics('math')
+    print("✅ reservation and outbox checks passed")
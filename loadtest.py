@@ -0,0 +1,272 @@
+"""
+Offline end-to-end load test for Repetitionsmail.
+Drives nightly runs through the real pipeline – main.run() with its crews, md_to_html,
+formula renderer, GmailSender and TopicDatabase – with a fake LLM instead of Anthropic
+and a local SMTP sink instead of Gmail, so it needs no API key or network. Everything is written
+to a temporary directory; the real database, logs and formula cache are untouched.
+
+Usage:
+    python loadtest.py                              # 20 runs, 4 at a time
+    python loadtest.py --runs 200 --concurrency 8   # more and wider
+    python loadtest.py --latency 2 --formulas 10    # slower LLM, formula-heavy sections
+    python loadtest.py --recipients 50              # every message to 50 recipients
+    python loadtest.py --section-scaling 8 --jitter 0   # one email's wall time with 1..8 sections
+"""
+
+import sys
+import time
+import random
+import logging
+import argparse
+import itertools
+import resource
+import dataclasses
+import tempfile
+import threading
+import concurrent.futures
+from datetime import date, timedelta
+from pathlib import Path
+
+import config
+import main
+from agents import SECTIONS
+from database import TopicDatabase, new_batch
+from tools.gmail_sender import GmailSender
+from tools.smtp_sink import SmtpSink
+from utils import metrics, latex_renderer
+from utils.fake_llm import FakeLLM
+from utils.hedging import percentile
+
+logger = logging.getLogger('loadtest')
+
+WORDS = (
+    "begreppet beskriver hur en struktur bevaras när vi byter perspektiv och visar varför "
+    "resultatet gäller i allmänhet samt vilka antaganden som krävs för att beviset ska hålla "
+    "exemplet nedan illustrerar idén med konkreta tal och en tydlig geometrisk tolkning"
+).split()
+
+INLINE_FORMULAS = [
+    "a_{{{n}}} = {a} k^2 + {b}",
+    "\\frac{{{a}}}{{{b}}} + \\frac{{1}}{{{n}}}",
+    "\\sqrt{{{a} + {b}}}",
+    "P(A) = 0.{n}",
+    "x^{{{a}}} \\cdot y^{{{b}}}",
+]
+BLOCK_FORMULAS = [
+    "\\int_0^{{{n}}} x^{{{a}}}\\,dx = \\frac{{{n}^{{{c}}}}}{{{c}}}",
+    "\\sum_{{k=1}}^{{{n}}} k^{{{a}}} \\leq {n}^{{{c}}}",
+    "\\lim_{{x \\to {a}}} \\frac{{x^2 - {b}}}{{x + {n}}}",
+    "E[X] = \\sum_{{i=1}}^{{{n}}} x_i \\, p_i",
+]
+
+_topic_ids = itertools.count(1)
+
+
+def fake_section(formulas: int, words: int, rng: random.Random) -> str:
+    """A section in the agents' markdown format with `formulas` formulas and ~`words` words."""
+    def _formula(pool: list) -> str:
+        a, b, n = rng.randint(2, 9), rng.randint(2, 9), rng.randint(10, 99)
+        return rng.choice(pool).format(a=a, b=b, n=n, c=a + 1)
+
+    blocks = formulas // 3
+    paragraphs = max(3, formulas - blocks)
+    parts = [f"TOPIC: Lasttest {next(_topic_ids)}: {rng.choice(WORDS).capitalize()}", "## Introduktion"]
+    for i in range(paragraphs):
+        text = " ".join(rng.choice(WORDS) for _ in range(words // paragraphs))
+        if i < formulas - blocks:
+            text += f" där ${_formula(INLINE_FORMULAS)}$ gäller."
+        parts.append(text)
+        if i < blocks:
+            parts.append(f"$${_formula(BLOCK_FORMULAS)}$$")
+    parts.append("## Sammanfattning")
+    parts.append("- " + "\n- ".join(" ".join(rng.choice(WORDS) for _ in range(8)) for _ in range(3)))
+    return "\n\n".join(parts)
+
+
+def make_llm(args, seed: int) -> FakeLLM:
+    """A FakeLLM built from the same class as get_llm()'s: limiter and length guard included."""
+    rng = random.Random(seed)
+    lock = threading.Lock()
+
+    def _answer(prompt: str) -> str:
+        if 'JSON-objekt som mappar id' in prompt:   # formula repair request
+            return "{}"
+        with lock:
+            return fake_section(args.formulas, args.words, rng)
+
+    delays = [max(0.0, rng.gauss(args.latency, args.latency * args.jitter)) for _ in range(10_000)]
+    return main.llm_class(FakeLLM)(delays=delays, answer_fn=_answer, max_tokens=4096)
+
+
+def simulate_run(db: TopicDatabase, llm, sender: GmailSender, day: date, recipients: int) -> bool:
+    """One nightly run through main.run(), with the fake LLM, the SMTP sink and the temporary database."""
+    return main.run(db=db, llm=llm, repair_llm=llm, sender=sender, day=day,
+                    recipients=[f"reader{i}@example.com" for i in range(recipients)])
+
+
+def section_scaling(args, db: TopicDatabase, llm) -> list[tuple[int, float, float]]:
+    """
+    (sections, wall, render) for one email with 1..`args.section_scaling` copies of the
+    first section. `render` is the formula work of the run spread over the shared render
+    workers (LATEX_MAX_WORKERS) – the part of the wall time that grows with the number of
+    formulas, not with how the sections are scheduled.
+    """
+    base = SECTIONS[0]
+    results = []
+    # n = 0 is an untimed warm-up: crewai's first kickoff pays its one-off imports
+    for n in range(0, args.section_scaling + 1):
+        sections = [dataclasses.replace(base, category=f"scale{i}", label=f"scale{i}", slot=i)
+                    for i in range(max(n, 1))]
+        batch = new_batch()
+        metrics.reset()
+        start = time.monotonic()
+        main.generate_email(db, llm, date.today() + timedelta(days=n), batch, sections, repair_llm=llm)
+        wall = time.monotonic() - start
+        samples = metrics.snapshot()['samples']
+        # render_seconds includes the wait for a free worker; only the rendering itself counts
+        work = sum(samples.get('latex.render_seconds', [])) - sum(samples.get('latex.worker_wait_seconds', []))
+        if n:
+            results.append((n, wall, work / config.LATEX_MAX_WORKERS))
+        db.release_reservations(batch)
+    return results
+
+
+def report_scaling(args, results: list[tuple[int, float, float]]) -> bool:
+    """
+    Print the scaling table. The check is on the wall time less the formula rendering,
+    which is shared by all sections. True if the sections within the pool limit ran
+    concurrently (together they added less than half an LLM call) and, when measured,
+    the first section past the limit waited for a free worker (it added at least half
+    an LLM call).
+    """
+    limit = config.MAX_PARALLEL_SECTIONS
+    print(f"\nSection scaling: LLM {args.latency:g}s ±{args.jitter:.0%}, {args.formulas} formulas/section, "
+          f"pool limit {limit}, {config.LATEX_MAX_WORKERS} render workers")
+    print(f"  {'sections':<10}{'wall':>9}{'render':>9}{'rest':>9}{'vs 1':>8}")
+    rest = {n: wall - render for n, wall, render in results}
+    for n, wall, render in results:
+        print(f"  {n:<10}{wall:>8.2f}s{render:>8.2f}s{rest[n]:>8.2f}s{rest[n] / rest[1]:>7.2f}×")
+
+    top = min(limit, len(rest))
+    within = rest[top] - rest[1]
+    flat = within < args.latency / 2
+    print(f"  1 → {top} sections: +{within:.2f}s besides rendering ({'flat' if flat else 'NOT flat'})")
+    if limit + 1 in rest:
+        step = rest[limit + 1] - rest[limit]
+        stepped = step >= args.latency / 2
+        print(f"  {limit} → {limit + 1} sections: +{step:.2f}s besides rendering "
+              f"({'steps at the limit' if stepped else 'no step'})")
+        flat = flat and stepped
+    return flat
+
+
+def _peak_rss_kb(pid: int) -> int | None:
+    """VmHWM of a live process from /proc (Linux only)."""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def _failed_sections() -> int:
+    return metrics.snapshot()['counters'].get('section.failed', 0)
+
+
+def report(args, wall: float, results: list, sink: SmtpSink):
+    samples = metrics.snapshot()['samples']
+    runs = len(results)
+    print(f"\nLoad test: {runs} runs × {len(SECTIONS)} sections, {args.concurrency} concurrent, "
+          f"LLM {args.latency:g}s ±{args.jitter:.0%}, {args.formulas} formulas/section, "
+          f"{args.recipients} recipient(s)")
+    print(f"  wall {wall:.1f}s – {runs / wall * 60:.1f} runs/min, {len(sink.sizes) / wall:.2f} messages/s, "
+          f"{results.count(False)} failed run(s), {_failed_sections()} failed section(s)")
+
+    print(f"\n  {'stage':<22}{'n':>7}{'p50':>9}{'p90':>9}{'p99':>9}{'max':>9}")
+    stages = [
+        ('generate (per run)',  'stage.generate'),
+        ('llm queued',          'llm.queued_seconds'),
+        ('llm generating',      'llm.generating_seconds'),
+        ('render worker wait',  'latex.worker_wait_seconds'),
+        ('formula render',      'latex.render_seconds'),
+        ('build MIME',          'stage.build'),
+        ('SMTP send',           'stage.send'),
+        ('db commit',           'stage.db'),
+    ]
+    for label, name in stages:
+        values = samples.get(name)
+        if values:
+            p50, p90, p99 = (percentile(values, p) for p in (50, 90, 99))
+            print(f"  {label:<22}{len(values):>7}{p50:>8.3f}s{p90:>8.3f}s{p99:>8.3f}s{max(values):>8.3f}s")
+
+    print(f"\n  {'size (KB)':<22}{'n':>7}{'p50':>9}{'p90':>9}{'max':>9}")
+    for label, values in [('HTML', samples.get('email.html_bytes', [])),
+                          ('MIME', samples.get('email.mime_bytes', [])),
+                          ('received by sink', sink.sizes)]:
+        if values:
+            kb = [v / 1024 for v in values]
+            print(f"  {label:<22}{len(kb):>7}{percentile(kb, 50):>9.1f}{percentile(kb, 90):>9.1f}{max(kb):>9.1f}")
+
+    # ru_maxrss is in KB on Linux (bytes on macOS)
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+    # RUSAGE_CHILDREN would only count reaped workers, and on Linux includes this process's
+    # RSS from before their exec – read each live worker's own high-water mark instead
+    workers = [kb / 1024 for kb in map(_peak_rss_kb, latex_renderer.worker_pids()) if kb]
+    worker_text = f"{max(workers):.0f} MB (largest of {len(workers)} render workers)" if workers else "n/a (render workers)"
+    print(f"\n  peak RSS: {own:.0f} MB (this process), {worker_text}")
+
+    counters = metrics.snapshot()['counters']
+    print("  counters: " + ", ".join(f"{k}={v}" for k, v in sorted(counters.items())))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Offline load test with a fake LLM and a local SMTP sink")
+    parser.add_argument('--runs', type=int, default=20, help="simulated nightly runs (one send date each)")
+    parser.add_argument('--concurrency', type=int, default=4, help="runs in flight at once")
+    parser.add_argument('--latency', type=float, default=0.5, help="mean fake LLM latency in seconds")
+    parser.add_argument('--jitter', type=float, default=0.3, help="latency standard deviation, relative to the mean")
+    parser.add_argument('--formulas', type=int, default=6, help="formulas per section")
+    parser.add_argument('--words', type=int, default=500, help="words per section")
+    parser.add_argument('--recipients', type=int, default=1, help="recipients per message")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--keep-cache', action='store_true',
+                        help="use the real formula cache instead of an empty one")
+    parser.add_argument('--section-scaling', type=int, metavar='N',
+                        help="instead of nightly runs, time one email with 1..N sections")
+    args = parser.parse_args()
+
+    # Warnings to the console only – the load test must not fill the real log file
+    root = logging.getLogger()
+    root.handlers[:] = [logging.StreamHandler()]
+    root.setLevel(logging.WARNING)
+    logging.getLogger('crew').setLevel(logging.WARNING)
+
+    with tempfile.TemporaryDirectory(prefix='loadtest-') as tmp:
+        tmp = Path(tmp)
+        config.RENDER_DIR = tmp / 'render'
+        config.LOG_DIR    = tmp
+        if not args.keep_cache:
+            config.FORMULA_CACHE_DIR = tmp / 'formulas'
+        db  = TopicDatabase(tmp / 'loadtest.db')
+        llm = make_llm(args, args.seed)
+        metrics.reset()
+
+        if args.section_scaling:
+            flat = report_scaling(args, section_scaling(args, db, llm))
+            sys.exit(0 if flat else 1)
+
+        first = date.today() + timedelta(days=1)
+        days = [first + timedelta(days=i) for i in range(args.runs)]
+        with SmtpSink() as sink:
+            sender = GmailSender(smtp_server='127.0.0.1', smtp_port=sink.port, starttls=False)
+            start = time.monotonic()
+            with concurrent.futures.ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+                results = list(pool.map(lambda d: simulate_run(db, llm, sender, d, args.recipients), days))
+            wall = time.monotonic() - start
+
+        report(args, wall, results, sink)
+    sys.exit(0 if all(results) and not _failed_sections() else 1)
@@ -1,53 +1,89 @@
 """
 Main orchestrator for Repetitionsmail.
-Runs three CrewAI agents in parallel, formats the output into a premium HTML email,
-logs used topics to SQLite, and sends via Gmail.
+Runs one CrewAI agent per registered section (agents/registry.py) on a bounded worker pool,
+formats the output into a premium HTML email, logs used topics to SQLite, and sends via Gmail.
 
 Usage:
-    python main.py           # Full run – sends email
-    python main.py --test    # Saves HTML to logs/, does not send
+    python main.py                     # Full run – generates and sends today's email
+    python main.py --test              # Saves HTML to logs/, does not send
+    python main.py generate --days N   # Pre-generates emails for the next N days into the outbox
+    python main.py send-due            # Sends today's queued email (no crewai/matplotlib import)
+    python main.py check-structured    # Compares structured (JSON) and markdown rendering on samples/
+    python main.py --warm              # Pre-builds font/TeX/formula caches in .cache/ (persist it)
 """
 
+from __future__ import annotations
+
 import sys
 import re
+import time
+import threading
 import logging
+import argparse
 import concurrent.futures
-from datetime import datetime
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+from email import message_from_bytes
 from pathlib import Path
-
-from crewai import Crew, LLM
+from typing import TYPE_CHECKING
 
 import config
-from database import TopicDatabase
-from agents import (
-    create_math_agent,       create_math_task,
-    create_philosophy_agent, create_philosophy_task,
-    create_society_agent,    create_society_task,
-)
+from database import TopicDatabase, new_batch
 from tools.gmail_sender import GmailSender
+from utils import metrics
+from utils.html_minify import minify_html, check_size
+from utils.formula_repair import repair_formulas
+from utils.hedging import hedge_delay, run_hedged
+from utils.length_control import output_budget, length_target
+from utils.log_setup import setup_logging, prune_logs
 from utils.latex_renderer import generate_latex_img
 
+# crewai (and the agents built on it) is slow to import and not needed by send-due
+if TYPE_CHECKING:
+    from crewai import Crew, LLM
+    from agents import Section, SectionOutput
+
 # ── Logging ─────────────────────────────────────────────────────────────────
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s  %(levelname)-8s  %(message)s',
-    handlers=[
-        logging.FileHandler(config.LOG_DIR / 'repetitionsmail.log'),
-        logging.StreamHandler(),
-    ]
-)
+setup_logging()
 logger = logging.getLogger(__name__)
+crew_logger = logging.getLogger('crew')
 
 
 # ── LLM factory ─────────────────────────────────────────────────────────────
-def get_llm() -> LLM:
+@lru_cache(maxsize=None)
+def llm_class(base: type) -> type:
+    """
+    `base` (a crewai LLM class) with the shared rate limiter in front
+    (utils/llm_limiter.py) and the length guard behind it (utils/length_control.py).
+    Built once per base; every LLM of the run is created from it.
+    """
+    from utils.llm_limiter import Limited
+    from utils.length_control import LengthGuarded
+
+    # Private crewai hooks the mixins extend – without them they quietly do nothing
+    for hook, feature in (('_track_token_usage_internal', "token accounting"),
+                          ('_emit_stream_chunk_event', "stopping answers at their target length")):
+        if not hasattr(base, hook):
+            logger.warning(f"{base.__name__} has no {hook} – {feature} is disabled")
+    return type(f"Repetitionsmail{base.__name__}", (Limited, LengthGuarded, base), {'__module__': __name__})
+
+
+def get_llm(max_tokens: int = config.LENGTH_DEFAULT_MAX_TOKENS) -> LLM:
+    """
+    A streaming Anthropic LLM whose calls all share one rate limiter and can be stopped
+    at a target length (see llm_class()).
+    """
+    from crewai.llms.providers.anthropic.completion import AnthropicCompletion
+
     if not config.ANTHROPIC_API_KEY:
         raise ValueError("ANTHROPIC_API_KEY is not set")
-    return LLM(
-        model=config.LLM_MODEL,
+    return llm_class(AnthropicCompletion)(
+        model=config.LLM_MODEL.removeprefix('anthropic/'),
         api_key=config.ANTHROPIC_API_KEY,
         temperature=0.75,
-        max_tokens=4096,
+        max_tokens=max_tokens,
+        stream=True,     # lets length_control end an answer that is long enough
+        max_retries=0,   # the limiter retries, honouring retry-after
     )
 
 
@@ -61,48 +97,134 @@ def _inline(text: str) -> str:
     return text
 
 
-def md_to_html(text: str, label: str) -> tuple[str, list]:
+PLACEHOLDER = re.compile(r'LATEX-(BLOCK|INLINE)-([A-Za-z0-9]+)-(\d+)')
+
+
+def _render_formulas(formulas: list[tuple], out_dir: Path, repair_llm: LLM | None = None) -> set[str]:
     """
-    Convert a markdown string to HTML paragraphs/headings/lists.
-    Also extracts $$...$$ and $...$ blocks and renders them to CID images.
-    Returns (html, list_of_cid_attachments).
+    Render every (placeholder, latex, filename, inline) formula to `out_dir`.
+    Formulas that fail are sent to the LLM for repair in one batch per round, at most
+    FORMULA_REPAIR_ATTEMPTS rounds within FORMULA_REPAIR_DEADLINE seconds; repaired
+    formulas are rendered on the same pool as the first pass. Returns the placeholders
+    that still failed.
     """
+    def _render(job):
+        _, latex, filename, inline = job
+        try:
+            generate_latex_img(latex, str(out_dir / filename), inline=inline)
+        except Exception as e:
+            logger.error(f"Failed to render LaTeX: {latex[:20]}... - {e}")
+            return f"{e}\n{getattr(e, 'log', '')}"
+        return None
+
+    # The renderer is thread-safe and bounds its own worker processes
+    pool = concurrent.futures.ThreadPoolExecutor(max_workers=config.LATEX_RENDER_THREADS)
+    try:
+        errors = list(pool.map(_render, formulas))
+
+        failed   = {i: err for i, err in enumerate(errors) if err}   # index -> error log
+        current  = {i: job[1] for i, job in enumerate(formulas)}     # index -> latest LaTeX tried
+        deadline = time.monotonic() + config.FORMULA_REPAIR_DEADLINE
+
+        for _ in range(config.FORMULA_REPAIR_ATTEMPTS):
+            if not failed or repair_llm is None:
+                break
+            fixes = repair_formulas(
+                repair_llm, [{'id': i, 'latex': current[i], 'error': err} for i, err in failed.items()]
+            )
+            if not fixes:
+                break
+            futures = {}
+            # A repair that came back after the deadline is not worth a render
+            for i, latex in (fixes.items() if time.monotonic() < deadline else ()):
+                placeholder, _, filename, inline = formulas[i]
+                current[i] = latex
+                futures[pool.submit(_render, (placeholder, latex, filename, inline))] = i
+            done, pending = concurrent.futures.wait(futures, timeout=max(0.0, deadline - time.monotonic()))
+            for fut in done:
+                i, err = futures[fut], fut.result()
+                if err:
+                    failed[i] = err
+                    metrics.incr('latex.repair_failed')
+                else:
+                    del failed[i]
+                    metrics.incr('latex.repaired')
+                    logger.info(f"[repair] Fixed formula: {current[i][:40]!r}")
+            if pending or (failed and time.monotonic() >= deadline):
+                # Whatever is still rendering is shown as text; its worker stops at its own timeout
+                metrics.incr('latex.repair_deadline')
+                logger.warning(f"[repair] Gave up after {config.FORMULA_REPAIR_DEADLINE}s with "
+                               f"{len(failed)} formula(s) still failing")
+                break
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    return {formulas[i][0] for i in failed}
+
+
+def _formula_tags(formulas: list[tuple], failed: set[str], out_dir: Path) -> tuple[dict, dict, list]:
+    """Map each placeholder to its <img> tag, or to a text fallback if it failed to render."""
+    images = {}
+    fallbacks = {}
     attachments = []
-    
-    # 1. Extract and render BLOCK LaTeX -> $$...$$
+    for placeholder, latex, filename, inline in formulas:
+        if placeholder in failed:
+            fallbacks[placeholder] = f'<code>{latex}</code>' if inline else f'<div class="math-fallback">[{latex}]</div>'
+            continue
+        attachments.append((str(out_dir / filename), filename))
+        if inline:
+            images[placeholder] = f'<img src="cid:{filename}" alt="LaTeX Inline" class="m-ii">'
+        else:
+            images[placeholder] = f'<div class="math-block"><img src="cid:{filename}" alt="LaTeX Block" class="m-bi"></div>'
+    return images, fallbacks, attachments
+
+
+def extract_formulas(text: str, label: str) -> tuple[str, list[tuple]]:
+    """
+    Replace $$...$$ and $...$ in markdown with placeholders.
+    Returns (text, [(placeholder, latex, filename, inline), ...]).
+    """
+    formulas = []
+
+    # 1. Extract BLOCK LaTeX -> $$...$$
     latex_blocks = re.findall(r'\$\$(.*?)\$\$', text, flags=re.DOTALL)
     for i, latex in enumerate(latex_blocks):
-        clean_latex = latex.strip()
-        filename = f"form_b_{label}_{i}.png"
-        filepath = config.LOG_DIR / filename
-        
-        try:
-            generate_latex_img(clean_latex, str(filepath), inline=False)
-            attachments.append((str(filepath), filename))
-            # No underscores in placeholder so _inline regex won't mangle it 
-            placeholder = f"LATEX-BLOCK-{label}-{i}"
-            text = text.replace(f"$${latex}$$", placeholder)
-        except Exception as e:
-            logger.error(f"Failed to render LaTeX block: {clean_latex[:20]}... - {e}")
-            text = text.replace(f"$${latex}$$", f'<div class="math-fallback">[{clean_latex}]</div>')
+        # No underscores in placeholder so _inline regex won't mangle it
+        placeholder = f"LATEX-BLOCK-{label}-{i}"
+        text = text.replace(f"$${latex}$$", placeholder)
+        formulas.append((placeholder, latex.strip(), f"form_b_{label}_{i}.png", False))
 
-    # 2. Extract and render INLINE LaTeX -> $...$
+    # 2. Extract INLINE LaTeX -> $...$
     inline_blocks = re.findall(r'(?<!\$)\$(?!\$)(.+?)(?<!\$)\$(?!\$)', text)
     # Deduplicate to avoid recreating same image
-    inline_blocks = list(set(inline_blocks))
+    inline_blocks = list(dict.fromkeys(inline_blocks))
     for i, latex in enumerate(inline_blocks):
-        clean_latex = latex.strip()
-        filename = f"form_i_{label}_{i}.png"
-        filepath = config.LOG_DIR / filename
-        
-        try:
-            generate_latex_img(clean_latex, str(filepath), inline=True)
-            attachments.append((str(filepath), filename))
-            placeholder = f"LATEX-INLINE-{label}-{i}"
-            text = text.replace(f"${latex}$", placeholder)
-        except Exception as e:
-            logger.error(f"Failed to render LaTeX inline: {clean_latex[:20]}... - {e}")
-            text = text.replace(f"${latex}$", f'<code>{clean_latex}</code>')
+        placeholder = f"LATEX-INLINE-{label}-{i}"
+        text = text.replace(f"${latex}$", placeholder)
+        formulas.append((placeholder, latex.strip(), f"form_i_{label}_{i}.png", True))
+
+    return text, formulas
+
+
+def md_to_html(text: str, label: str, out_dir: Path = config.LOG_DIR,
+               repair_llm: LLM | None = None) -> tuple[str, list]:
+    """
+    Convert a markdown string to HTML paragraphs/headings/lists.
+    Also extracts $$...$$ and $...$ blocks and renders them to CID images in `out_dir`;
+    formulas that fail are repaired via `repair_llm` when given.
+    Returns (html, list_of_cid_attachments).
+    """
+    out_dir.mkdir(parents=True, exist_ok=True)
+    text, formulas = extract_formulas(text, label)
+
+    # 3. Render, repair what failed, show the rest as text
+    failed = _render_formulas(formulas, out_dir, repair_llm)
+    images, fallbacks, attachments = _formula_tags(formulas, failed, out_dir)
+
+    text = PLACEHOLDER.sub(lambda m: fallbacks.get(m.group(0), m.group(0)), text)
+
+    def _splice(line: str) -> str:
+        return PLACEHOLDER.sub(lambda m: images.get(m.group(0), m.group(0)), line)
 
     lines = text.split('\n')
     out = []
@@ -119,53 +241,91 @@ def md_to_html(text: str, label: str) -> tuple[str, list]:
             continue
             
         if s.startswith('### '):
-            out.append(f'<h3 style="font-size:16px;font-weight:600;color:#1e293b;margin:18px 0 6px;">{_inline(s[4:])}</h3>')
+            out.append(f'<h3 class="m-h3">{_splice(_inline(s[4:]))}</h3>')
         elif s.startswith('## '):
-            out.append(f'<h2 style="font-size:18px;font-weight:700;color:#0f172a;margin:24px 0 8px;">{_inline(s[3:])}</h2>')
+            out.append(f'<h2 class="m-h2">{_splice(_inline(s[3:]))}</h2>')
         elif s.startswith('# '):
-            out.append(f'<h1 style="font-size:20px;font-weight:700;color:#0f172a;margin:24px 0 10px;">{_inline(s[2:])}</h1>')
+            out.append(f'<h1 class="m-h1">{_splice(_inline(s[2:]))}</h1>')
         elif s.startswith('> '):
-            out.append(f'<blockquote>{_inline(s[2:])}</blockquote>')
+            out.append(f'<blockquote>{_splice(_inline(s[2:]))}</blockquote>')
         elif re.match(r'^[\-\*]\s+', s):
             if not in_list:
-                out.append('<ul style="color:#334155; margin:10px 0 16px; padding-left:22px;">')
+                out.append('<ul class="m-ul">')
                 in_list = True
             content = re.sub(r'^[\-\*]\s+', '', s)
-            out.append(f'<li style="margin-bottom:8px;">{_inline(content)}</li>')
+            out.append(f'<li class="m-li">{_splice(_inline(content))}</li>')
         else:
             if in_list:
                 out.append('</ul>')
                 in_list = False
             
-            processed_line = _inline(s)
-            
-            # Revert placeholders
-            for filepath, filename in attachments:
-                if filename.startswith('form_b_'):
-                    idx = filename.split('_')[-1].replace('.png', '')
-                    lbl = filename.split('_')[2]
-                    ph = f"LATEX-BLOCK-{lbl}-{idx}"
-                    if ph in processed_line:
-                        img_tag = f'<div class="math-block" style="text-align:center; margin:20px 0; padding:15px; background-color:#f8fafc; border-radius:8px;"><img src="cid:{filename}" alt="LaTeX Block" style="max-width:100%; height:auto;"></div>'
-                        processed_line = processed_line.replace(ph, img_tag)
-                elif filename.startswith('form_i_'):
-                    idx = filename.split('_')[-1].replace('.png', '')
-                    lbl = filename.split('_')[2]
-                    ph = f"LATEX-INLINE-{lbl}-{idx}"
-                    if ph in processed_line:
-                        img_tag = f'<img src="cid:{filename}" alt="LaTeX Inline" style="max-width:100%; height:1.6em; vertical-align:middle; margin:0 2px;">'
-                        processed_line = processed_line.replace(ph, img_tag)
-                        
+            processed_line = _splice(_inline(s))
+
             if '<div' in processed_line:
                 out.append(processed_line)
             else:
-                out.append(f'<p style="margin-bottom:16px;">{processed_line}</p>')
+                out.append(f'<p class="m-p">{processed_line}</p>')
 
     if in_list:
         out.append('</ul>')
     return '\n'.join(out), attachments
 
 
+def section_to_html(section: SectionOutput, label: str, out_dir: Path = config.LOG_DIR,
+                    repair_llm: LLM | None = None) -> tuple[str, list]:
+    """
+    Convert structured section output to the same HTML md_to_html produces.
+    The formula table goes to the renderer first and the blocks are converted while it
+    runs – the text is never scanned for $...$.
+    Returns (html, list_of_cid_attachments).
+    """
+    from agents.schema import FORMULA_REF
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    formulas = []
+    refs = {}
+    counts = {True: 0, False: 0}
+    for f in section.formulas:
+        i = counts[f.display]
+        counts[f.display] += 1
+        if f.display:
+            placeholder, filename = f"LATEX-BLOCK-{label}-{i}", f"form_b_{label}_{i}.png"
+        else:
+            placeholder, filename = f"LATEX-INLINE-{label}-{i}", f"form_i_{label}_{i}.png"
+        refs[f.id] = placeholder
+        formulas.append((placeholder, f.latex.strip(), filename, not f.display))
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as pool:
+        rendering = pool.submit(_render_formulas, formulas, out_dir, repair_llm)
+
+        def _text(s: str) -> str:
+            return FORMULA_REF.sub(lambda m: refs[m.group(1)], _inline(s.strip()))
+
+        out = []
+        for block in section.blocks:
+            if block.type == 'heading':
+                level = min(max(block.level, 1), 3)
+                out.append(f'<h{level} class="m-h{level}">{_text(block.text)}</h{level}>')
+            elif block.type == 'paragraph':
+                out.append(f'<p class="m-p">{_text(block.text)}</p>')
+            elif block.type == 'quote':
+                out.append(f'<blockquote>{_text(block.text)}</blockquote>')
+            elif block.type == 'list':
+                out.append('<ul class="m-ul">')
+                out.extend(f'<li class="m-li">{_text(item)}</li>' for item in block.items)
+                out.append('</ul>')
+            elif block.type == 'formula':
+                out.append(refs[block.formula])
+            out.append('')
+
+        failed = rendering.result()
+
+    images, fallbacks, attachments = _formula_tags(formulas, failed, out_dir)
+    tags = {**images, **fallbacks}
+    html = PLACEHOLDER.sub(lambda m: tags.get(m.group(0), m.group(0)), '\n'.join(out).strip())
+    return html, attachments
+
+
 # ── Topic extraction ─────────────────────────────────────────────────────────
 def extract_topic_and_body(raw: str) -> tuple[str, str]:
     """
@@ -195,10 +355,24 @@ def extract_topic_and_body(raw: str) -> tuple[str, str]:
 
 # ── Per-crew runner (for parallel execution) ─────────────────────────────────
 def run_crew(label: str, crew: Crew) -> str:
+    """Kick off a crew; logs one compact summary instead of crewai's transcript."""
     logger.info(f"[{label}] Starting crew…")
+    start = time.monotonic()
     result = crew.kickoff()
     text = str(result)
-    logger.info(f"[{label}] Done – {len(text)} chars")
+    usage = getattr(result, 'token_usage', None)
+    crew_logger.info(
+        f"[{label}] Done – {len(text)} chars",
+        extra={
+            'section':    label,
+            'seconds':    round(time.monotonic() - start, 2),
+            'chars':      len(text),
+            'words':      len(text.split()),
+            'tokens_in':  getattr(usage, 'prompt_tokens', None),
+            'tokens_out': getattr(usage, 'completion_tokens', None),
+        },
+    )
+    crew_logger.debug(f"[{label}] Answer:\n{text}", extra={'section': label})
     return text
 
 
@@ -217,150 +391,461 @@ def accent_bg(color: str) -> str:
     return f"{color}14"
 
 
+SECTION_BLOCK = re.compile(r'<!-- section:begin[^>]*-->(.*?)<!-- section:end -->', re.DOTALL)
+
+
+def _fill(tmpl: str, replacements: dict) -> str:
+    for k, v in replacements.items():
+        # Use lambda to avoid interpreting backslashes in value 'v' as regex references
+        tmpl = re.sub(r'\{\{\s*' + k + r'\s*\}\}', lambda m: v, tmpl)
+    return tmpl
+
+
 def build_html(
-    math_topic: str,    math_html: str,
-    phil_topic: str,    phil_html: str,
-    society_topic: str, society_html: str,
+    sections: list[tuple[Section, str, str]],
     date_str: str,
     accent: str,
     main_title: str,
 ) -> str:
+    """`sections` holds (section, topic, html) in the order they appear in the email."""
     template_path = config.TEMPLATE_DIR / 'email.html'
     tmpl = template_path.read_text(encoding='utf-8')
 
-    replacements = {
+    block = SECTION_BLOCK.search(tmpl).group(1)
+    blocks = []
+    for i, (section, topic, html) in enumerate(sections):
+        last = i == len(sections) - 1
+        blocks.append(_fill(block, {
+            'section_label':  section.label,
+            'section_border': '' if last else 'border-bottom: 1px solid #f1f5f9; ',
+            'section_tint':   section.tint,
+            'section_color':  section.color,
+            'section_icon':   section.icon,
+            'section_title':  section.title,
+            'section_topic':  topic,
+            'section_content': html,
+        }))
+
+    # Sections go in last so their content is never scanned for placeholders
+    tmpl = _fill(tmpl, {
         'date': date_str,
         'accent_color': accent,
         'accent_bg': accent_bg(accent),
-        'math_topic': math_topic,
-        'math_content': math_html,
-        'phil_topic': phil_topic,
-        'phil_content': phil_html,
-        'society_topic': society_topic,
-        'society_content': society_html,
         'main_title': main_title,
-    }
-    
-    for k, v in replacements.items():
-        # Use lambda to avoid interpreting backslashes in value 'v' as regex references
-        tmpl = re.sub(r'\{\{\s*' + k + r'\s*\}\}', lambda m: v, tmpl)
-
-    return tmpl
+    })
+    return SECTION_BLOCK.sub(lambda m: ''.join(blocks), tmpl)
 
 
-def swedish_date() -> str:
-    today = datetime.now()
-    day = ['Måndag','Tisdag','Onsdag','Torsdag','Fredag','Lördag','Söndag'][today.weekday()]
+def swedish_date(day: date | None = None) -> str:
+    today = day or datetime.now()
+    weekday = ['Måndag','Tisdag','Onsdag','Torsdag','Fredag','Lördag','Söndag'][today.weekday()]
     month = ['januari','februari','mars','april','maj','juni',
              'juli','augusti','september','oktober','november','december'][today.month - 1]
-    return f"{day} {today.day} {month} {today.year}"
+    return f"{weekday} {today.day} {month} {today.year}"
 
 
-# ── Main ─────────────────────────────────────────────────────────────────────
-def run(test_mode: bool = False):
-    logger.info("=== Repetitionsmail starting ===")
-
-    if not config.validate_config():
-        logger.error("Config validation failed – aborting")
-        sys.exit(1)
-
-    db  = TopicDatabase()
-    llm = get_llm()
-
-    # Load used topics per category
-    math_used    = db.get_recent_topics('math',        days=60)
-    phil_used    = db.get_recent_topics('philosophy',  days=60)
-    soc_used     = db.get_recent_topics('society',     days=60)
+# ── Generation ───────────────────────────────────────────────────────────────
+def generate_section(db: TopicDatabase, llm: LLM, section: Section,
+                     send_date: str, batch: str) -> tuple[str, str | SectionOutput]:
+    """
+    Run one section's crew and reserve its topic for `send_date` under `batch`.
+    A crew that runs past the section's usual generation time is hedged (utils/hedging.py).
+    max_tokens comes from the section's earlier lengths, and a markdown answer is stopped
+    after the paragraph under its closing heading (utils/length_control.py).
+    If another queued day already took the topic, regenerate with the updated list.
+    Returns (topic, body): markdown, or SectionOutput in structured mode.
+    """
+    from crewai import Crew
+    from agents import parse_section_output
+    from utils import crew_locks
+
+    # Concurrent sections must not poll crewai's file locks (utils/crew_locks.py)
+    crew_locks.install()
+    category   = section.category
+    structured = config.STRUCTURED_OUTPUT
+    budget     = output_budget(db.recent_lengths(category, config.LENGTH_HISTORY), section.target_words)
+    # A copy keeps the class (limiter, length guard) and the client; only max_tokens differs
+    section_llm = llm.model_copy(update={'max_tokens': budget})
+    logger.info(f"[{category}] max_tokens={budget}, target {section.target_words} words")
+    for attempt in range(1, config.TOPIC_RESERVE_ATTEMPTS + 1):
+        used  = db.get_recent_topics(category, days=60)
+
+        def _generate(n: int, cancel: threading.Event) -> tuple[str, dict]:
+            # Each (hedged) request gets its own agent and crew; the losing one is cancelled
+            start = time.monotonic()
+            agent = section.create_agent(section_llm)
+            task  = section.create_task(agent, used, structured=structured)
+            crew  = Crew(agents=[agent], tasks=[task], verbose=config.CREW_VERBOSE)
+            # A JSON answer cannot be cut short, so only markdown answers are stopped early
+            with length_target(None if structured else section.target_words, cancel) as target:
+                raw = run_crew(category if n == 0 else f"{category}/hedge", crew)
+            # Usage of a stream that was cut off is incomplete – keep it out of the token history
+            tokens = None if target.stopped else (target.output_tokens or None)
+            if tokens and tokens >= budget:
+                metrics.incr('length.truncated')
+                logger.warning(f"[{category}] Answer used its whole budget of {budget} tokens – probably cut off")
+            return raw, dict(seconds=time.monotonic() - start, words=len(raw.split()),
+                             output_tokens=tokens, max_tokens=budget)
+
+        delay = hedge_delay(db.recent_generation_times(category, config.HEDGE_HISTORY))
+        raw, stats = run_hedged(category, _generate, delay)
+        # Only the answer that was used goes into the history – a cancelled loser's time
+        # would skew the hedge percentile
+        db.record_generation_time(category, **stats)
+        last = attempt == config.TOPIC_RESERVE_ATTEMPTS
+        if structured:
+            try:
+                body = parse_section_output(raw)
+            except ValueError as e:
+                metrics.incr('structured.invalid')
+                if last:
+                    raise
+                logger.warning(f"[{category}] Invalid structured output – regenerating: {e}")
+                continue
+            topic = body.topic
+        else:
+            topic, body = extract_topic_and_body(raw)
+        if db.reserve_topic(category, topic, send_date, batch, force=last):
+            return topic, body
+        logger.warning(f"[{category}] {topic!r} is taken by another day – regenerating")
 
-    # Build agents & tasks
-    math_agent    = create_math_agent(llm)
-    phil_agent    = create_philosophy_agent(llm)
-    soc_agent     = create_society_agent(llm)
 
-    math_task     = create_math_task(math_agent,    math_used)
-    phil_task     = create_philosophy_task(phil_agent, phil_used)
-    soc_task      = create_society_task(soc_agent,  soc_used)
+def build_section(db: TopicDatabase, llm: LLM, repair_llm: LLM, section: Section,
+                  send_date: str, batch: str, out_dir: Path) -> tuple[str, str, list]:
+    """
+    Generate one section and render it right away, so its formulas are drawn while
+    the other crews are still running. Returns (topic, html, attachments).
+    """
+    topic, body = generate_section(db, llm, section, send_date, batch)
+    if isinstance(body, str):
+        used = [(latex, inline) for _, latex, _, inline in extract_formulas(body, section.label)[1]]
+        html, attachments = md_to_html(body, section.label, out_dir, repair_llm)
+    else:
+        used = [(f.latex.strip(), not f.display) for f in body.formulas]
+        html, attachments = section_to_html(body, section.label, out_dir, repair_llm)
+    # Formula history for `main.py --warm`
+    db.record_formulas(used)
+    return topic, html, attachments
 
-    # Three independent crews
-    crew_math = Crew(agents=[math_agent], tasks=[math_task],  verbose=True)
-    crew_phil = Crew(agents=[phil_agent], tasks=[phil_task],  verbose=True)
-    crew_soc  = Crew(agents=[soc_agent],  tasks=[soc_task],   verbose=True)
 
-    # Run in parallel
-    logger.info("Launching three crews in parallel…")
-    with concurrent.futures.ThreadPoolExecutor(max_workers=3) as pool:
+def generate_email(db: TopicDatabase, llm: LLM, day: date, batch: str,
+                   sections: list[Section] | None = None, repair_llm: LLM | None = None) -> dict:
+    """
+    Generate, render and assemble the email for `day`, reserving its topics under `batch`
+    (database.new_batch()); the caller commits or releases them by that batch.
+    `sections` defaults to every registered section, `repair_llm` (broken formulas) to
+    get_llm() with FORMULA_REPAIR_MAX_TOKENS.
+    Returns a dict with subject, html, attachments and `failed` (True if any crew failed).
+    """
+    from agents import SECTIONS, sections_by_slot
+
+    sections  = sections if sections is not None else SECTIONS
+    send_date = day.isoformat()
+    out_dir   = config.RENDER_DIR / send_date
+    # Broken formulas get one small repair request per section
+    if repair_llm is None:
+        repair_llm = get_llm(max_tokens=config.FORMULA_REPAIR_MAX_TOKENS)
+
+    # Run in parallel on a bounded pool
+    workers = max(1, min(len(sections), config.MAX_PARALLEL_SECTIONS))
+    logger.info(f"[{send_date}] Launching {len(sections)} crews on {workers} workers…")
+    failed = False
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
         futures = {
-            pool.submit(run_crew, 'math',        crew_math): 'math',
-            pool.submit(run_crew, 'philosophy',  crew_phil): 'philosophy',
-            pool.submit(run_crew, 'society',     crew_soc):  'society',
+            pool.submit(build_section, db, llm, repair_llm, section, send_date, batch, out_dir): section
+            for section in sections
         }
         results = {}
         for fut in concurrent.futures.as_completed(futures):
-            label = futures[fut]
+            section = futures[fut]
             try:
-                results[label] = fut.result()
+                results[section.category] = fut.result()
             except Exception as exc:
-                logger.error(f"[{label}] crew failed: {exc}", exc_info=True)
-                results[label] = f"TOPIC: Fel\n\nKunde inte generera innehåll: {exc}"
+                logger.error(f"[{section.category}] crew failed: {exc}", exc_info=True)
+                html, _ = md_to_html(f"Kunde inte generera innehåll: {exc}", section.label, out_dir)
+                results[section.category] = ('Fel', html, [])
+                metrics.incr('section.failed')
+                failed = True
+
+    # Assemble in email order
+    rendered = []
+    all_attachments = []
+    for section in sections_by_slot(sections):
+        topic, html, attachments = results[section.category]
+        rendered.append((section, topic, html))
+        all_attachments += attachments
 
-    # Extract topics + convert to HTML
-    math_topic,    math_body    = extract_topic_and_body(results['math'])
-    phil_topic,    phil_body    = extract_topic_and_body(results['philosophy'])
-    society_topic, society_body = extract_topic_and_body(results['society'])
+    # Build email
+    accent  = WEEKDAY_ACCENT[day.weekday()]
+    date_sv = swedish_date(day)
 
-    math_html,    math_attach = md_to_html(math_body, "math")
-    phil_html,    phil_attach = md_to_html(phil_body, "phil")
-    society_html, soc_attach  = md_to_html(society_body, "soc")
-    
-    all_attachments = math_attach + phil_attach + soc_attach
+    main_title = " · ".join(topic.split(':')[0] for _, topic, _ in rendered)
+    subject_topics = [results[s.category][0].split(':')[0] for s in sections if s.in_subject]
 
-    # Build email
-    today   = datetime.now()
-    accent  = WEEKDAY_ACCENT[today.weekday()]
-    date_sv = swedish_date()
-    
-    main_title = f"{society_topic.split(':')[0]} · {phil_topic.split(':')[0]} · {math_topic.split(':')[0]}"
+    return {
+        'subject':     " · ".join(["Repetitionsmail", *subject_topics, date_sv]),
+        'html':        minify_html(build_html(rendered, date_sv, accent, main_title)),
+        'attachments': all_attachments,
+        'failed':      failed,
+    }
 
-    html = build_html(
-        math_topic,    math_html,
-        phil_topic,    phil_html,
-        society_topic, society_html,
-        date_sv, accent, main_title
-    )
 
-    subject = f"Repetitionsmail · {math_topic.split(':')[0]} · {phil_topic.split(':')[0]} · {date_sv}"
+# ── Main ─────────────────────────────────────────────────────────────────────
+def run(test_mode: bool = False, db: TopicDatabase | None = None, llm: LLM | None = None,
+        repair_llm: LLM | None = None, sender: GmailSender | None = None,
+        day: date | None = None, recipients: list[str] | None = None) -> bool:
+    """
+    Generate the email for `day` (today), send it to `recipients` (GMAIL_RECIPIENT) and
+    log its topics, or in test mode save a preview instead. The database, LLMs and sender
+    default to the real ones; loadtest.py injects a fake LLM and a local SMTP sink.
+    Returns True on success.
+    """
+    logger.info("=== Repetitionsmail starting ===")
+    prune_logs()
+
+    # Only what is not injected needs credentials
+    if (llm is None or sender is None) and not config.validate_config(require_llm=llm is None):
+        logger.error("Config validation failed – aborting")
+        return False
+
+    db         = db or TopicDatabase()
+    llm        = llm or get_llm()
+    sender     = sender or GmailSender()
+    recipients = recipients or [config.GMAIL_RECIPIENT]
+
+    day       = day or date.today()
+    send_date = day.isoformat()
+    batch     = new_batch()
+    # A queued message for today keeps its reservations; anything else for today is a leftover
+    db.drop_stale_reservations(send_date)
+    start     = time.monotonic()
+    email     = generate_email(db, llm, day, batch, repair_llm=repair_llm)
+    metrics.observe('stage.generate', time.monotonic() - start)
+    subject   = email['subject']
+    all_attachments = email['attachments']
+
+    messages = []
+    for recipient in recipients:
+        start = time.monotonic()
+        msg = sender.build_message(
+            recipient=recipient,
+            subject=subject,
+            html_content=email['html'],
+            attachments=all_attachments,
+        )
+        metrics.observe('stage.build', time.monotonic() - start)
+        messages.append(msg)
+    check_size(email['html'], len(messages[0].as_bytes()), send_date)
 
     if test_mode:
-        ts = today.strftime('%Y%m%d_%H%M%S')
+        db.release_reservations(batch)
+        ts = datetime.now().strftime('%Y%m%d_%H%M%S')
         out = config.LOG_DIR / f"preview_{ts}.html"
-        out.write_text(html, encoding='utf-8')
+        out.write_text(email['html'], encoding='utf-8')
         logger.info(f"✅ TEST MODE – HTML saved to {out}")
         print(f"\n{'='*60}")
         print(f"Preview: {out}")
         print(f"Subjects: {subject}")
         print(f"Attachments: {len(all_attachments)}")
         print(f"{'='*60}\n")
+        metrics.log_summary()
+        return True
+
+    ok = True
+    for msg in messages:
+        start = time.monotonic()
+        ok = sender.send_message(msg) and ok
+        metrics.observe('stage.send', time.monotonic() - start)
+    start = time.monotonic()
+    if ok:
+        # Log topics to DB only after successful send
+        db.commit_reservations(batch)
+        logger.info("✅ Email sent and topics logged")
     else:
-        sender = GmailSender()
-        ok = sender.send_email(
-            recipient=config.GMAIL_RECIPIENT,
-            subject=subject,
-            html_content=html,
-            attachments=all_attachments,
+        db.release_reservations(batch)
+        logger.error("❌ Email send failed – topics NOT logged")
+    metrics.observe('stage.db', time.monotonic() - start)
+    metrics.log_summary()
+    return ok
+
+
+def _generate_and_enqueue(db: TopicDatabase, llm: LLM, day: date) -> bool:
+    send_date = day.isoformat()
+    batch     = new_batch()
+    db.drop_stale_reservations(send_date)
+    try:
+        email = generate_email(db, llm, day, batch)
+        if email['failed']:
+            raise RuntimeError("one or more sections failed")
+        msg = GmailSender().build_message(
+            config.GMAIL_RECIPIENT, email['subject'], email['html'], email['attachments']
         )
-        if ok:
-            # Log topics to DB only after successful send
-            db.log_topic('math',       math_topic)
-            db.log_topic('philosophy', phil_topic)
-            db.log_topic('society',    society_topic)
-            logger.info("✅ Email sent and topics logged")
-        else:
-            logger.error("❌ Email send failed – topics NOT logged")
-            sys.exit(1)
+        data = msg.as_bytes()
+        check_size(email['html'], len(data), send_date)
+        db.enqueue_message(send_date, email['subject'], data, batch)
+        return True
+    except Exception as exc:
+        logger.error(f"[{send_date}] Generation failed – not queued: {exc}")
+        db.release_reservations(batch)
+        return False
+
+
+def generate_queue(days: int):
+    """Pre-generate finished messages for the `days` days starting tomorrow, in parallel."""
+    logger.info(f"=== Repetitionsmail generating {days} day(s) ===")
+    prune_logs()
+
+    if not config.validate_config():
+        logger.error("Config validation failed – aborting")
+        sys.exit(1)
+
+    db  = TopicDatabase()
+    llm = get_llm()
+
+    queued  = set(db.queued_dates())
+    tomorrow = date.today() + timedelta(days=1)
+    pending = [tomorrow + timedelta(days=i) for i in range(days)]
+    pending = [d for d in pending if d.isoformat() not in queued]
+    if not pending:
+        logger.info("Outbox already full – nothing to generate")
+        return
+
+    workers = min(len(pending), config.GENERATE_PARALLEL_DAYS)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        ok = list(pool.map(lambda d: _generate_and_enqueue(db, llm, d), pending))
+
+    metrics.log_summary()
+    logger.info(f"✅ Queued {sum(ok)}/{len(pending)} day(s)")
+    if not all(ok):
+        sys.exit(1)
+
+
+def send_due() -> int:
+    """
+    Send today's queued message. Returns 0 if sent, 1 on send failure, 2 if nothing was queued.
+    Queued messages for past days are dropped so the email never shows a stale date.
+    """
+    if not config.validate_config(require_llm=False):
+        logger.error("Config validation failed – aborting")
+        return 1
+
+    db    = TopicDatabase()
+    today = date.today().isoformat()
+
+    row = db.next_due_message(today)
+    while row and row['send_date'] < today:
+        logger.warning(f"Dropping stale queued email for {row['send_date']}")
+        db.drop_message(row['id'])
+        row = db.next_due_message(today)
+
+    if row is None:
+        logger.info("Nothing queued for today")
+        return 2
+
+    msg = message_from_bytes(row['message'])
+    msg.replace_header('Date', GmailSender.date_header())
+    if not GmailSender().send_message(msg):
+        logger.error("❌ Queued email could not be sent – left in outbox")
+        return 1
+
+    db.mark_sent(row['id'])
+    logger.info(f"✅ Queued email for {today} sent and topics logged")
+    return 0
+
+
+def warm() -> int:
+    """
+    Pre-build matplotlib's font cache, the TeX format and fonts, and render the formulas
+    most used in history into the formula cache. Prints how long each step took.
+    """
+    from utils.latex_renderer import warm_up
+
+    formulas = TopicDatabase().common_formulas(config.WARM_FORMULAS)
+    start = time.monotonic()
+    steps = warm_up(formulas)
+    total = time.monotonic() - start
+
+    snap = metrics.snapshot()['counters']
+    print(f"Warm-up of {config.CACHE_DIR}:")
+    for name, seconds in steps:
+        print(f"  {name:<40} {seconds:7.2f}s")
+    print(f"  {'total':<40} {total:7.2f}s")
+    print(f"  formulas: {snap.get('latex.cache_hit', 0)} already cached, "
+          f"{snap.get('latex.usetex', 0) + snap.get('latex.mathtext', 0)} rendered, "
+          f"{snap.get('latex.text_fallback', 0) + snap.get('latex.rejected', 0)} failed")
+    return 0
+
+
+def check_structured() -> bool:
+    """
+    Validate the structured path against the markdown path on the shared sample sections
+    in samples/sections. The structured path must keep every literal dollar sign of the
+    text. Samples without one must give the same topic, HTML and attachments on both
+    paths; with one, the markdown path is expected to read them as formula delimiters,
+    and its divergence is reported, not failed.
+    """
+    import difflib
+    import tempfile
+    from agents import parse_section_output, to_markdown
+    from agents.schema import FORMULA_REF
+
+    ok = True
+    # The rendered PNGs are only compared, never kept
+    with tempfile.TemporaryDirectory(prefix='check-structured-') as tmp:
+        for path in sorted(config.SAMPLES_DIR.glob('*.json')):
+            section = parse_section_output(path.read_text(encoding='utf-8'))
+            topic, body = extract_topic_and_body(to_markdown(section))
+
+            out_dir = Path(tmp) / path.stem
+            md_html, md_attach = md_to_html(body, 'sample', out_dir / 'md')
+            js_html, js_attach = section_to_html(section, 'sample', out_dir / 'json')
+            md_html, js_html = minify_html(md_html), minify_html(js_html)
+
+            texts = [FORMULA_REF.sub('', t) for block in section.blocks for t in [block.text, *block.items]]
+            dollars = sum(t.count('$') for t in texts)
+            same = (
+                topic == section.topic
+                and md_html == js_html
+                # attachment order has no meaning in the MIME message
+                and sorted(name for _, name in md_attach) == sorted(name for _, name in js_attach)
+            )
+            kept = js_html.count('$') == dollars
+            passed = kept and (same or dollars > 0)
+            print(f"{'✓' if passed else '✗'} {path.name}: {len(section.blocks)} blocks, {len(section.formulas)} formulas, "
+                  f"{dollars} literal $")
+            if not kept:
+                print(f"  structured path kept {js_html.count('$')} of {dollars} literal $")
+            if dollars and not same:
+                print("  markdown path diverges as expected: it reads literal $ as formula delimiters")
+            if not passed:
+                ok = False
+            if topic != section.topic:
+                print(f"  topic: {topic!r} vs {section.topic!r}")
+            if not same:
+                for line in difflib.unified_diff(md_html.split('><'), js_html.split('><'), 'markdown', 'structured', lineterm=''):
+                    print(f"  {line}")
+    return ok
 
 
 if __name__ == '__main__':
-    test_mode = '--test' in sys.argv
-    if test_mode:
-        print("🧪 TEST MODE – saves HTML to logs/, does not send email")
-    run(test_mode=test_mode)
+    parser = argparse.ArgumentParser(description="Repetitionsmail")
+    parser.add_argument('command', nargs='?', default='run',
+                        choices=['run', 'generate', 'send-due', 'check-structured'])
+    parser.add_argument('--test', action='store_true', help="save HTML to logs/ instead of sending")
+    parser.add_argument('--days', type=int, default=3, help="number of days to pre-generate")
+    parser.add_argument('--warm', action='store_true',
+                        help="pre-build font, TeX and formula caches in CACHE_DIR and exit")
+    args = parser.parse_args()
+
+    if args.warm:
+        sys.exit(warm())
+    elif args.command == 'generate':
+        generate_queue(args.days)
+    elif args.command == 'send-due':
+        sys.exit(send_due())
+    elif args.command == 'check-structured':
+        sys.exit(0 if check_structured() else 1)
+    else:
+        if args.test:
+            print("🧪 TEST MODE – saves HTML to logs/, does not send email")
+        sys.exit(0 if run(test_mode=args.test) else 1)
@@ -8,6 +8,7 @@ import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from email.mime.image import MIMEImage
+from email.message import Message
 from datetime import datetime
 import logging
 import os
@@ -17,56 +18,66 @@ logger = logging.getLogger(__name__)
 
 
 class GmailSender:
-    def __init__(self):
+    def __init__(self, smtp_server: str = "smtp.gmail.com", smtp_port: int = 587, starttls: bool = True):
         self.sender_email = config.GMAIL_SENDER
         self.app_password  = config.GMAIL_APP_PASSWORD
-        self.smtp_server   = "smtp.gmail.com"
-        self.smtp_port     = 587
+        self.smtp_server   = smtp_server
+        self.smtp_port     = smtp_port
+        self.starttls      = starttls    # False only for a local server, e.g. tools/smtp_sink.py
 
-    def send_email(self, recipient: str, subject: str, html_content: str, attachments: list = None) -> bool:
+    @staticmethod
+    def date_header() -> str:
+        return datetime.now().strftime("%a, %d %b %Y %H:%M:%S +0000")
+
+    def build_message(self, recipient: str, subject: str, html_content: str, attachments: list = None) -> MIMEMultipart:
         """
-        Sends an HTML email, optionally with inline attachments (CID).
-        
+        Builds the complete MIME message, optionally with inline attachments (CID).
+
         Args:
             recipient: Recipient email address.
             subject: Email subject.
             html_content: HTML body.
             attachments: List of tuples (file_path, cid_name).
         """
-        try:
-            # 'related' is required for CID images
-            msg_root = MIMEMultipart('related')
-            msg_root['Subject'] = subject
-            msg_root['From']    = self.sender_email
-            msg_root['To']      = recipient
-            msg_root['Date']    = datetime.now().strftime("%a, %d %b %Y %H:%M:%S +0000")
-
-            # Encapsulate the HTML part in 'alternative'
-            msg_alternative = MIMEMultipart('alternative')
-            msg_root.attach(msg_alternative)
-
-            html_part = MIMEText(html_content, 'html', 'utf-8')
-            msg_alternative.attach(html_part)
-
-            # Attach images with CID
-            if attachments:
-                for file_path, cid_name in attachments:
-                    if not os.path.exists(file_path):
-                        logger.warning(f"Attachment not found: {file_path}")
-                        continue
-                        
-                    with open(file_path, 'rb') as f:
-                        img = MIMEImage(f.read())
-                        img.add_header('Content-ID', f'<{cid_name}>')
-                        img.add_header('Content-Disposition', 'inline', filename=cid_name)
-                        msg_root.attach(img)
+        # 'related' is required for CID images
+        msg_root = MIMEMultipart('related')
+        msg_root['Subject'] = subject
+        msg_root['From']    = self.sender_email
+        msg_root['To']      = recipient
+        msg_root['Date']    = self.date_header()
+
+        # Encapsulate the HTML part in 'alternative'
+        msg_alternative = MIMEMultipart('alternative')
+        msg_root.attach(msg_alternative)
+
+        html_part = MIMEText(html_content, 'html', 'utf-8')
+        msg_alternative.attach(html_part)
+
+        # Attach images with CID
+        if attachments:
+            for file_path, cid_name in attachments:
+                if not os.path.exists(file_path):
+                    logger.warning(f"Attachment not found: {file_path}")
+                    continue
+
+                with open(file_path, 'rb') as f:
+                    img = MIMEImage(f.read())
+                    img.add_header('Content-ID', f'<{cid_name}>')
+                    img.add_header('Content-Disposition', 'inline', filename=cid_name)
+                    msg_root.attach(img)
+
+        return msg_root
 
+    def send_message(self, msg: Message) -> bool:
+        """Sends an already built message (e.g. one popped from the outbox)."""
+        try:
             with smtplib.SMTP(self.smtp_server, self.smtp_port) as server:
-                server.starttls()
+                if self.starttls:
+                    server.starttls()
                 server.login(self.sender_email, self.app_password)
-                server.send_message(msg_root)
+                server.send_message(msg)
 
-            logger.info(f"✅ Email sent to {recipient} – {subject!r} ({len(attachments or [])} attachments)")
+            logger.info(f"✅ Email sent to {msg['To']} – {msg['Subject']!r}")
             return True
 
         except smtplib.SMTPAuthenticationError:
@@ -75,3 +86,15 @@ class GmailSender:
         except Exception as e:
             logger.error(f"❌ Failed to send email: {e}")
             return False
+
+    def send_email(self, recipient: str, subject: str, html_content: str, attachments: list = None) -> bool:
+        """
+        Sends an HTML email, optionally with inline attachments (CID).
+        See build_message() for the arguments.
+        """
+        try:
+            msg_root = self.build_message(recipient, subject, html_content, attachments)
+        except Exception as e:
+            logger.error(f"❌ Failed to build email: {e}")
+            return False
+        return self.send_message(msg_root)
@@ -0,0 +1,110 @@
+"""
+Local SMTP sink for offline runs.
+Speaks just enough SMTP (EHLO, AUTH, MAIL, RCPT, DATA) for GmailSender with
+starttls=False, accepts every message and keeps its size – nothing is delivered.
+"""
+
+import base64
+import logging
+import threading
+import socketserver
+
+logger = logging.getLogger(__name__)
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def _reply(self, line: str):
+        self.wfile.write(f"{line}\r\n".encode('ascii'))
+
+    def handle(self):
+        sink = self.server.sink
+        recipients = 0
+        self._reply("220 smtp-sink ready")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode('utf-8', errors='replace').strip()
+            verb = command.split(' ', 1)[0].upper()
+
+            if verb == 'EHLO':
+                self._reply("250-smtp-sink")
+                self._reply("250-AUTH PLAIN LOGIN")
+                self._reply("250 8BITMIME")
+            elif verb == 'HELO':
+                self._reply("250 smtp-sink")
+            elif verb == 'AUTH':
+                if command.upper().startswith('AUTH LOGIN'):
+                    # Username and password prompts; the answers are ignored
+                    for prompt in ('Username:', 'Password:'):
+                        self._reply(f"334 {base64.b64encode(prompt.encode()).decode()}")
+                        self.rfile.readline()
+                self._reply("235 authenticated")
+            elif verb == 'MAIL':
+                recipients = 0
+                self._reply("250 OK")
+            elif verb == 'RCPT':
+                recipients += 1
+                self._reply("250 OK")
+            elif verb == 'DATA':
+                self._reply("354 end data with <CR><LF>.<CR><LF>")
+                size = 0
+                while True:
+                    chunk = self.rfile.readline()
+                    if not chunk or chunk == b'.\r\n':
+                        break
+                    size += len(chunk)
+                sink.record(size, recipients)
+                self._reply("250 OK queued")
+            elif verb in ('RSET', 'NOOP'):
+                self._reply("250 OK")
+            elif verb == 'QUIT':
+                self._reply("221 bye")
+                return
+            else:
+                self._reply("502 command not implemented")
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class SmtpSink:
+    """
+    Threaded SMTP server on 127.0.0.1. Use as a context manager; `port` is picked
+    by the OS unless given. `sizes` holds the byte size of every accepted message.
+    """
+
+    def __init__(self, port: int = 0):
+        self._server = _Server(('127.0.0.1', port), _Handler)
+        self._server.sink = self
+        self.port = self._server.server_address[1]
+        self.sizes = []
+        self.recipients = 0
+        self._lock = threading.Lock()
+
+    def record(self, size: int, recipients: int):
+        with self._lock:
+            self.sizes.append(size)
+            self.recipients += recipients
+
+    def __enter__(self):
+        threading.Thread(target=self._server.serve_forever, name='smtp-sink', daemon=True).start()
+        logger.info(f"SMTP sink listening on 127.0.0.1:{self.port}")
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+if __name__ == '__main__':
+    # Self-test: send one message through GmailSender into the sink
+    from tools.gmail_sender import GmailSender
+
+    logging.basicConfig(level=logging.INFO)
+    with SmtpSink() as sink:
+        sender = GmailSender(smtp_server='127.0.0.1', smtp_port=sink.port, starttls=False)
+        ok = sender.send_email('test@example.com', 'Test', '<p>Hej</p>')
+    print(f"sent={ok} received={len(sink.sizes)} sizes={sink.sizes}")
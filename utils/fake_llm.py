@@ -0,0 +1,88 @@
+"""
+Offline stand-in for the Anthropic LLM.
+A crewai BaseLLM that answers with a canned section after an injectable delay, so the
+generation pipeline can be exercised without network access or API cost.
+"""
+
+import re
+import time
+import threading
+from types import SimpleNamespace
+from typing import Any, Callable, List, Optional
+
+from crewai.llms.base_llm import BaseLLM
+from pydantic import PrivateAttr
+
+SAMPLE_ANSWER = (
+    "TOPIC: Testämne\n\n"
+    "## Bakgrund\n\n"
+    "En kort text med en inline-formel $a^2 + b^2 = c^2$ och en fristående:\n\n"
+    "$$\\int_0^1 x^2\\,dx = \\frac{1}{3}$$\n\n"
+    "- Första punkten\n"
+    "- Andra punkten"
+)
+
+
+class FakeRateLimitError(Exception):
+    """Looks like an anthropic.RateLimitError to utils.llm_limiter."""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"429 rate limited, retry after {retry_after}s")
+        self.status_code = 429
+        self.response = SimpleNamespace(status_code=429, headers={'retry-after': str(retry_after)})
+
+
+class FakeLLM(BaseLLM):
+    """
+    Sleeps, then returns `answer` (or `answer_fn(prompt)`) as a crewai Final Answer.
+
+    `delays` is consumed one value per call (the last value repeats), so a test can make
+    exactly the first request slow. The first `throttled_calls` calls fail with a 429
+    carrying `retry_after`. With stream=True the answer is emitted word by word.
+    """
+    delays: List[float] = [0.0]
+    answer: str = SAMPLE_ANSWER
+    answer_fn: Optional[Callable[[str], str]] = None
+    throttled_calls: int = 0
+    retry_after: float = 0.5
+    max_tokens: int = 4096
+    calls: int = 0
+
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+
+    def __init__(self, **data: Any):
+        data.setdefault('model', 'fake')
+        super().__init__(**data)
+
+    def _next_call(self) -> int:
+        with self._lock:
+            self.calls += 1
+            return self.calls - 1
+
+    def call(self, messages, tools=None, callbacks=None, available_functions=None,
+             from_task=None, from_agent=None, response_model=None) -> str:
+        i = self._next_call()
+        if i < self.throttled_calls:
+            raise FakeRateLimitError(self.retry_after)
+        delay = self.delays[min(i, len(self.delays) - 1)]
+
+        prompt = messages if isinstance(messages, str) else "\n".join(
+            str(m.get('content', '')) for m in messages
+        )
+        text = self.answer_fn(prompt) if self.answer_fn else self.answer
+        # Agents run a ReAct loop – a plain Final Answer ends it after one call
+        if from_agent is not None:
+            text = f"Thought: Jag kan svara direkt.\nFinal Answer: {text}"
+
+        if self.stream:
+            # Word by word over the same total delay, like a streamed answer
+            chunks = re.findall(r'\S+\s*|\s+', text)
+            for chunk in chunks:
+                time.sleep(delay / len(chunks))
+                self._emit_stream_chunk_event(chunk=chunk, from_task=from_task, from_agent=from_agent)
+        else:
+            time.sleep(delay)
+
+        usage = {'input_tokens': len(prompt) // 4, 'output_tokens': len(text) // 4}
+        self._track_token_usage_internal({**usage, 'total_tokens': sum(usage.values())})
+        return text
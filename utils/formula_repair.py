@@ -0,0 +1,72 @@
+"""
+Targeted repair of formulas that failed to render.
+The failing formulas are sent together with an excerpt of their TeX/mathtext error in
+one small batched request that asks only for corrected LaTeX – far cheaper than
+regenerating the whole section.
+"""
+
+import re
+import json
+import logging
+
+from utils import metrics
+
+logger = logging.getLogger(__name__)
+
+REPAIR_PROMPT = (
+    "Följande LaTeX-formler kunde inte renderas (matplotlib: usetex med amsmath, "
+    "annars mathtext). Rätta varje formel så att den kan renderas, utan att ändra dess "
+    "matematiska innebörd. Skriv formeln utan omgivande $-tecken.\n"
+    "Svara ENBART med ett JSON-objekt som mappar id till rättad LaTeX, "
+    'till exempel {"0": "\\\\frac{a}{b}"}.\n\n'
+)
+
+
+def error_excerpt(log: str, limit: int = 400) -> str:
+    """Keep the lines of a worker log that say what went wrong (TeX '!' lines, exceptions)."""
+    lines = []
+    for line in log.splitlines():
+        line = line.strip()
+        if (line.startswith('!') or 'Error' in line or 'Exception' in line) and line not in lines:
+            lines.append(line)
+    excerpt = '\n'.join(lines) or log.strip()
+    return excerpt[-limit:]
+
+
+def _parse_response(text: str) -> dict:
+    match = re.search(r'\{.*\}', text, flags=re.DOTALL)
+    if not match:
+        return {}
+    data = json.loads(match.group(0))
+    return {int(k): v.strip().strip('$').strip() for k, v in data.items() if isinstance(v, str)}
+
+
+def repair_formulas(llm, failures: list[dict]) -> dict[int, str]:
+    """
+    Ask the LLM for corrected LaTeX for every failed formula in one request.
+
+    Args:
+        llm: A crewai LLM (a small max_tokens budget is enough).
+        failures: Dicts with 'id', 'latex' and 'error' (the worker log).
+
+    Returns:
+        Mapping id -> corrected LaTeX. Empty if the request or its parsing failed;
+        a repair problem never fails the email.
+    """
+    if not failures:
+        return {}
+
+    parts = [REPAIR_PROMPT]
+    for f in failures:
+        parts.append(f"id: {f['id']}\nLaTeX: {f['latex']}\nFel: {error_excerpt(f['error'])}\n")
+
+    metrics.incr('latex.repair_requests')
+    logger.info(f"[repair] Asking for {len(failures)} corrected formula(s)")
+    try:
+        fixes = _parse_response(str(llm.call('\n'.join(parts))))
+    except Exception as e:
+        logger.warning(f"[repair] Request failed: {e}")
+        return {}
+
+    wanted = {f['id'] for f in failures}
+    return {k: v for k, v in fixes.items() if k in wanted and v}
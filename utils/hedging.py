@@ -0,0 +1,151 @@
+"""
+Hedged requests for slow generations.
+If a section is still running after a high percentile of its recent generation times,
+an identical second request is started and whichever finishes first is used. Hedges
+are limited by a per-process budget so a slow API can't double the load.
+
+Each attempt gets a threading.Event that is set when the other attempt wins; the
+generation passes it to length_control.length_target(), which stops the loser's stream
+at its next chunk so it gives back its limiter slot and token reservation at once.
+Attempts are not daemon threads: a cancelled loser is still unwinding through crewai
+when the winner returns, and must be done before crewai's exit handler shuts its event
+bus down.
+"""
+
+import math
+import queue
+import logging
+import threading
+from typing import Callable, Optional, Sequence, TypeVar
+
+import config
+from utils import metrics
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+
+class HedgeBudget:
+    """Thread-safe count of hedges left in this process."""
+
+    def __init__(self, limit: int):
+        self._left = limit
+        self._lock = threading.Lock()
+
+    def try_spend(self) -> bool:
+        with self._lock:
+            if self._left <= 0:
+                return False
+            self._left -= 1
+            return True
+
+
+budget = HedgeBudget(config.HEDGE_BUDGET)
+
+
+def percentile(values: Sequence[float], pct: float) -> float:
+    """Nearest-rank percentile of `values` (0 < pct <= 100)."""
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def hedge_delay(recent_seconds: Sequence[float]) -> Optional[float]:
+    """
+    Seconds to wait before hedging, from a section's recent generation times.
+    None (never hedge) until there are HEDGE_MIN_SAMPLES samples.
+    """
+    if len(recent_seconds) < config.HEDGE_MIN_SAMPLES:
+        return None
+    return percentile(recent_seconds, config.HEDGE_PERCENTILE)
+
+
+def run_hedged(label: str, attempt: Callable[[int, threading.Event], T], delay: Optional[float],
+               hedge_budget: HedgeBudget = budget) -> T:
+    """
+    Run `attempt(0, cancel)`; if it has not finished after `delay` seconds and the budget
+    allows, also run `attempt(1, cancel)`. Returns the first successful result and sets
+    the other attempt's `cancel` event. If every started attempt fails, the first error
+    is raised.
+    """
+    results = queue.Queue()
+    cancels = [threading.Event(), threading.Event()]
+
+    def _run(n: int):
+        try:
+            results.put((n, attempt(n, cancels[n]), None))
+        except BaseException as e:
+            if cancels[n].is_set():
+                logger.info(f"[{label}] Attempt {n} cancelled")
+                metrics.incr('hedge.cancelled')
+                return
+            if not isinstance(e, Exception):
+                raise
+            results.put((n, None, e))
+
+    def _start(n: int):
+        threading.Thread(target=_run, args=(n,), name=f"{label}-attempt{n}").start()
+
+    _start(0)
+    started = 1
+    try:
+        n, result, error = results.get(timeout=delay)
+    except queue.Empty:
+        if not hedge_budget.try_spend():
+            logger.info(f"[{label}] Slower than {delay:.1f}s but the hedge budget is spent")
+            metrics.incr('hedge.budget_exhausted')
+            n, result, error = results.get()
+        else:
+            logger.warning(f"[{label}] No answer after {delay:.1f}s – starting a hedged request")
+            metrics.incr('hedge.started')
+            _start(1)
+            started = 2
+            n, result, error = results.get()
+
+    first_error = error
+    while error is not None and started > 1:
+        # One attempt failed – wait for the other before giving up
+        started -= 1
+        n, result, error = results.get()
+
+    if error is not None:
+        raise first_error
+    for other, cancel in enumerate(cancels[:started]):
+        if other != n:
+            cancel.set()
+    if n == 1:
+        metrics.incr('hedge.won')
+        logger.info(f"[{label}] Hedged request won")
+    return result
+
+
+if __name__ == '__main__':
+    # Self-test with a streaming fake LLM whose first answer is slow
+    import time
+    from utils.fake_llm import FakeLLM
+    from utils.length_control import LengthGuarded, length_target
+
+    logging.basicConfig(level=logging.INFO)
+
+    class GuardedFakeLLM(LengthGuarded, FakeLLM):
+        pass
+
+    def _timed(delays, delay, hedge_budget):
+        llm = GuardedFakeLLM(delays=delays, answer=' '.join(['ok'] * 40), stream=True)
+
+        def _attempt(n, cancel):
+            with length_target(None, cancel):
+                return f"{len(llm.call('hej').split())} words (attempt {n})"
+
+        start = time.monotonic()
+        result = run_hedged('test', _attempt, delay, hedge_budget)
+        return result, time.monotonic() - start
+
+    print(_timed([2.0, 0.1], delay=0.3, hedge_budget=HedgeBudget(1)))   # hedge wins after ~0.4s
+    print(_timed([0.1, 0.1], delay=0.3, hedge_budget=HedgeBudget(1)))   # no hedge needed
+    print(_timed([1.0, 0.1], delay=0.3, hedge_budget=HedgeBudget(0)))   # budget spent – waits ~1s
+    time.sleep(0.3)
+    counters = metrics.snapshot()['counters']
+    print(counters)
+    assert counters.get('hedge.cancelled') == 1, "the slow first attempt was not cancelled"
@@ -0,0 +1,98 @@
+"""
+Final HTML stage before the email is built.
+Normalises and de-duplicates CSS declarations, minifies the markup and reports the
+message size against Gmail's clipping limit (~102 KB of HTML). Body styling stays in
+the template's <style> block as short classes – inlining it on every element would
+cost more bytes than minifying saves.
+"""
+
+import re
+import logging
+
+import config
+from utils import metrics
+
+logger = logging.getLogger(__name__)
+
+STYLE_ATTR    = re.compile(r'style="([^"]*)"')
+STYLE_BLOCK   = re.compile(r'(<style[^>]*>)(.*?)(</style>)', re.DOTALL | re.IGNORECASE)
+# Plain comments only – Outlook conditional comments (<!--[if mso]>) must survive
+HTML_COMMENT  = re.compile(r'<!--(?!\[if).*?-->', re.DOTALL)
+CSS_COMMENT   = re.compile(r'/\*.*?\*/', re.DOTALL)
+
+
+def dedupe_declarations(style: str) -> str:
+    """
+    Compact a declaration list and drop exact repeats.
+    Repeated properties with different values are kept – they are deliberate fallbacks
+    (e.g. a solid `background` before a gradient).
+    """
+    seen = set()
+    out = []
+    for decl in style.split(';'):
+        prop, sep, value = decl.partition(':')
+        if not sep:
+            continue
+        value = ' '.join(value.split()).replace(' !important', '!important')
+        decl = f"{prop.strip().lower()}:{value}"
+        if decl not in seen:
+            seen.add(decl)
+            out.append(decl)
+    return ';'.join(out)
+
+
+def minify_css(css: str) -> str:
+    css = CSS_COMMENT.sub('', css)
+    css = ' '.join(css.split())
+    css = re.sub(r'\s*([{};,>])\s*', r'\1', css)
+    css = re.sub(r':\s+', ':', css).replace(' !important', '!important')
+    return css.replace(';}', '}')
+
+
+def minify_html(html: str) -> str:
+    html = HTML_COMMENT.sub('', html)
+    html = STYLE_ATTR.sub(lambda m: f'style="{dedupe_declarations(m.group(1))}"', html)
+    # Line breaks between tags carry no meaning; any other whitespace run becomes one space
+    html = re.sub(r'>\s*\n\s*<', '><', html)
+    html = re.sub(r'\s+', ' ', html)
+    html = STYLE_BLOCK.sub(lambda m: m.group(1) + minify_css(m.group(2)) + m.group(3), html)
+    return html.strip()
+
+
+def check_size(html: str, mime_bytes: int, label: str = 'email') -> bool:
+    """
+    Record HTML and MIME sizes in the run metrics and warn when the HTML approaches
+    Gmail's clipping limit. Returns False if the message would be clipped.
+    """
+    html_bytes = len(html.encode('utf-8'))
+    metrics.observe('email.html_bytes', html_bytes)
+    metrics.observe('email.mime_bytes', mime_bytes)
+    logger.info(f"[{label}] HTML {html_bytes / 1024:.1f} KB, MIME {mime_bytes / 1024:.1f} KB")
+
+    if html_bytes >= config.GMAIL_CLIP_BYTES:
+        logger.error(f"[{label}] HTML exceeds Gmail's clipping limit – the email will be clipped")
+        return False
+    if html_bytes >= config.GMAIL_CLIP_BYTES * config.GMAIL_CLIP_WARN_RATIO:
+        logger.warning(
+            f"[{label}] HTML is at {html_bytes / config.GMAIL_CLIP_BYTES:.0%} of Gmail's clipping limit"
+        )
+    return True
+
+
+if __name__ == '__main__':
+    # Self-test: the sample sections in the full template must only ever get smaller
+    import tempfile
+    from pathlib import Path
+    from agents import SECTIONS, parse_section_output
+    from main import build_html, section_to_html
+
+    with tempfile.TemporaryDirectory() as tmp:
+        parts = []
+        for section in SECTIONS:
+            sample = parse_section_output((config.SAMPLES_DIR / f"{section.category}.json").read_text(encoding='utf-8'))
+            html, _ = section_to_html(sample, section.label, Path(tmp))
+            parts.append((section, sample.topic, html))
+    html = build_html(parts, '19 oktober 2026', '#4facfe', 'Repetitionsmail')
+    before, after = len(html.encode('utf-8')), len(minify_html(html).encode('utf-8'))
+    print(f"{before} B -> {after} B ({1 - after / before:.0%} smaller)")
+    assert after <= before, "minifying made the email bigger"
@@ -1,51 +1,583 @@
-import matplotlib
-matplotlib.use('Agg') # Force non-GUI backend
-import matplotlib.pyplot as plt
+"""
+LaTeX → PNG rendering for the formulas in the email.
+
+Formulas are rendered by a small pool of long-lived worker processes that import
+matplotlib once, under memory/CPU limits and with a scrubbed environment. Every formula
+has a wall-clock timeout; a worker that times out or dies is killed and replaced, so a
+pathological formula can never hang the nightly run.
+Rendering degrades step by step: usetex → mathtext → RenderError (the caller then
+falls back to showing the raw LaTeX as text).
+
+Rendered PNGs are kept in a content-addressed cache (config.FORMULA_CACHE_DIR), and
+matplotlib's and TeX's own caches are pointed into config.CACHE_DIR, so a persisted
+cache directory plus `warm_up()` makes the first formula of a run as cheap as the last.
+"""
+
+import io
 import os
-from pathlib import Path
+import re
+import sys
+import json
+import time
+import hashlib
+import tempfile
+import shutil
+import queue
+import atexit
+import signal
+import logging
+import threading
+import subprocess
+import traceback
+from functools import lru_cache
+
+import config
+from utils import metrics
+
+logger = logging.getLogger(__name__)
+
+# Font list, TeX output and generated TeX fonts go to directories that can be persisted
+# between runs. Set before matplotlib is imported here or in a worker (which inherits them).
+os.environ.setdefault('MPLCONFIGDIR', str(config.MPL_CACHE_DIR))
+os.environ.setdefault('TEXMFVAR', str(config.TEXMF_CACHE_DIR))
+
+# Bump when render_png's output changes, so stale cached PNGs are not reused
+CACHE_VERSION = 2
+
+# Full LaTeX support for complex environments like pmatrix. The TeX manager only reads
+# the preamble and font family from rcParams; they never change, so they are set once
+# per process.
+LATEX_PREAMBLE = r'\usepackage{amsmath}'
+
+# Bounds the number of live worker processes across all rendering threads
+_worker_slots = threading.BoundedSemaphore(config.LATEX_MAX_WORKERS)
+
+# The only environment variables a worker (and the TeX it runs) gets – no secrets
+WORKER_ENV = ('PATH', 'HOME', 'MPLCONFIGDIR', 'TEXMFVAR', 'SYSTEMROOT')
+WORKER_SETTINGS = {
+    'MPLBACKEND': 'Agg', 'OPENBLAS_NUM_THREADS': '1', 'OMP_NUM_THREADS': '1',
+    # kpathsea: TeX may only open files below its working directory and never run programs,
+    # whatever a formula manages to get past check_formula()
+    'openin_any': 'p', 'openout_any': 'p', 'shell_escape': 'f',
+}
+
+# Environments that carry their own math mode and must not be wrapped in $...$
+BLOCK_ENVS = [r"\begin{align", r"\begin{equation", r"\begin{gather", r"\begin{pmatrix"]
+
+# TeX primitives that touch the file system or redefine the parser – never needed for a formula.
+# \csname, \expandafter and ^^ notation could spell any of them without writing its name;
+# anything with input/include in its name (\InputIfFileExists, \verbatiminput) reads files,
+# and control sequences with @ (\@input, \@@input) are LaTeX internals.
+FORBIDDEN = re.compile(
+    r'\\(openin|openout|write|immediate|read|catcode|special|makeatletter|'
+    r'usepackage|documentclass|def|edef|gdef|xdef|let|loop|csname|expandafter|scantokens)(?![a-zA-Z])'
+    r'|\\[a-zA-Z]*(?:input|Input|include|Include)'
+    r'|\\[a-zA-Z]*@'
+    r'|\^\^'
+)
+
+
+class RenderError(Exception):
+    """A formula could not be rendered. `log` holds the worker's error output, if any."""
+
+    def __init__(self, message: str, log: str = ''):
+        super().__init__(message)
+        self.log = log
+
+
+class RenderTimeout(RenderError):
+    pass
+
+
+# ── Input limits ─────────────────────────────────────────────────────────────
+def check_formula(latex_code: str):
+    """Reject formulas that are too large, too deeply nested or use unsafe primitives."""
+    if not latex_code.strip():
+        raise RenderError("empty formula")
+    if len(latex_code) > config.LATEX_MAX_CHARS:
+        raise RenderError(f"formula too long ({len(latex_code)} > {config.LATEX_MAX_CHARS} chars)")
+    match = FORBIDDEN.search(latex_code)
+    if match:
+        raise RenderError(f"forbidden command {match.group(0)}")
+
+    depth = max_depth = 0
+    for ch in re.sub(r'\\[{}]', '', latex_code):
+        if ch == '{':
+            depth += 1
+            max_depth = max(max_depth, depth)
+        elif ch == '}':
+            depth -= 1
+            if depth < 0:
+                raise RenderError("unbalanced braces")
+    if depth != 0:
+        raise RenderError("unbalanced braces")
+    if max_depth > config.LATEX_MAX_DEPTH:
+        raise RenderError(f"formula nested too deeply ({max_depth} > {config.LATEX_MAX_DEPTH})")
+
+
+def wrap_formula(latex_code: str, inline: bool) -> str:
+    # If the AI uses a block environment, don't wrap it in $...$
+    if any(env in latex_code for env in BLOCK_ENVS):
+        return latex_code
+    if inline:
+        return f"${latex_code}$"
+    # Use displaystyle for full size sums/integrals even in simple lines
+    return f"$\\displaystyle {latex_code}$"
+
+
+# ── Worker side (runs in a separate process) ─────────────────────────────────
+def _apply_memory_limit(memory_mb: int):
+    """Cap address space. Inherited by latex/dvipng child processes."""
+    try:
+        import resource
+    except ImportError:  # not available on Windows
+        return
+    limit = memory_mb * 1024 * 1024
+    try:
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    except (ValueError, OSError) as e:
+        print(f"could not apply memory limit: {e}", file=sys.stderr)
+
+
+def _apply_cpu_limit(cpu_seconds: int):
+    """Allow the next job `cpu_seconds` of CPU on top of what this worker has used so far."""
+    try:
+        import resource
+    except ImportError:
+        return
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    soft = int(usage.ru_utime + usage.ru_stime) + cpu_seconds
+    try:
+        resource.setrlimit(resource.RLIMIT_CPU, (soft, resource.RLIM_INFINITY))
+    except (ValueError, OSError) as e:
+        print(f"could not apply CPU limit: {e}", file=sys.stderr)
+
+
+_init_lock = threading.Lock()
+_initialized = False
+
+
+def _init_matplotlib():
+    global _initialized
+    with _init_lock:
+        if not _initialized:
+            import matplotlib
+            matplotlib.rcParams['text.latex.preamble'] = LATEX_PREAMBLE
+            # Per-text family= is ignored by usetex, which would otherwise pick \sffamily
+            matplotlib.rcParams['font.family'] = 'serif'
+            _initialized = True
+
+
+def render_png(full_latex: str, usetex: bool) -> bytes:
+    """
+    Render one formula to PNG bytes.
+    Uses the object-oriented Figure/FigureCanvasAgg API with every setting passed per call,
+    so it touches no pyplot state and is safe to call from several threads.
+    """
+    _init_matplotlib()
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    # Create figure with a small size, will be tight-boxed later
+    fig = Figure(figsize=(0.1, 0.1))
+    FigureCanvasAgg(fig)
+    # Render text. Using a larger fontsize helps with DPI clarity
+    fig.text(0, 0, full_latex, fontsize=14, color='black', usetex=usetex)
+
+    # High DPI and transparent background; bbox_inches='tight' crops to the formula only
+    buf = io.BytesIO()
+    fig.savefig(buf, format='png', bbox_inches='tight', pad_inches=0.05, dpi=150, transparent=True)
+    return buf.getvalue()
+
+
+def _write_atomic(data: bytes, output_path: str):
+    # Via a temp file so a killed worker never leaves a half-written PNG behind.
+    # The name is unique per thread: two sections may cache the same formula at once.
+    tmp_path = f"{output_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, output_path)
+
+
+def _worker_main() -> int:
+    """
+    Worker loop: one JSON job per line on stdin, one JSON reply per line on stdout.
+    Replies {"ok": true} once matplotlib is loaded, then one per job.
+    """
+    # config loads .env on import – drop whatever that put back before TeX inherits it
+    for key in list(os.environ):
+        if key not in WORKER_ENV and key not in WORKER_SETTINGS:
+            del os.environ[key]
+    # Replies get their own copy of stdout; stray prints from matplotlib go to stderr
+    replies = os.fdopen(os.dup(1), 'w', encoding='utf-8', buffering=1)
+    os.dup2(2, 1)
+
+    def _reply(**reply):
+        replies.write(json.dumps(reply) + '\n')
+
+    _apply_memory_limit(config.LATEX_MEMORY_MB)
+    _init_matplotlib()
+    from matplotlib import font_manager
+    font_manager.findfont('serif')
+    _reply(ok=True)
+
+    for line in sys.stdin:
+        job = json.loads(line)
+        _apply_cpu_limit(job['cpu_seconds'])
+        try:
+            _write_atomic(render_png(job['latex'], job['usetex']), job['output_path'])
+        except MemoryError:
+            # The heap may be in any state – report and let the parent start a fresh worker
+            _reply(ok=False, log=traceback.format_exc(), fatal=True)
+            return 1
+        except Exception:
+            _reply(ok=False, log=traceback.format_exc())
+            continue
+        _reply(ok=True)
+    return 0
+
+
+# ── Parent side ──────────────────────────────────────────────────────────────
+@lru_cache(maxsize=None)
+def usetex_available() -> bool:
+    ok = shutil.which('latex') is not None and shutil.which('dvipng') is not None
+    if not ok:
+        logger.warning("latex/dvipng not found – rendering with mathtext only")
+    return ok
+
+
+def _kill(proc: subprocess.Popen):
+    try:
+        if os.name == 'posix':
+            os.killpg(proc.pid, signal.SIGKILL)  # also takes down latex/dvipng
+        else:
+            proc.kill()
+    except ProcessLookupError:
+        pass
+
+
+def _worker_env() -> dict:
+    env = {key: os.environ[key] for key in WORKER_ENV if key in os.environ}
+    return dict(env, **WORKER_SETTINGS)
+
+
+class _Worker:
+    """One long-lived `--worker` process and a thread that collects its replies."""
+
+    def __init__(self):
+        self.proc = subprocess.Popen(
+            [sys.executable, '-m', 'utils.latex_renderer', '--worker'],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            cwd=config.PROJECT_ROOT, env=_worker_env(), text=True, encoding='utf-8', bufsize=1,
+            start_new_session=(os.name == 'posix'),
+        )
+        self.jobs = 0
+        self._replies = queue.Queue()
+        threading.Thread(target=self._read, name=f'latex-worker-{self.proc.pid}', daemon=True).start()
+        self._reply(config.LATEX_START_TIMEOUT)   # ready once matplotlib is imported
+
+    def _read(self):
+        for line in self.proc.stdout:
+            self._replies.put(line)
+        self._replies.put(None)
+
+    def _reply(self, timeout: float) -> dict:
+        try:
+            line = self._replies.get(timeout=timeout)
+        except queue.Empty:
+            self.kill()
+            raise RenderTimeout(f"timed out after {timeout:g}s")
+        if line is None:
+            raise RenderError(f"worker exited with code {self.proc.wait()}")
+        return json.loads(line)
+
+    @property
+    def alive(self) -> bool:
+        return self.proc.poll() is None
 
-def generate_latex_img(latex_code: str, output_path: str, inline: bool = False):
+    def render(self, job: dict, timeout: float):
+        self.jobs += 1
+        try:
+            self.proc.stdin.write(json.dumps(job) + '\n')
+            self.proc.stdin.flush()
+        except OSError:
+            raise RenderError(f"worker exited with code {self.proc.wait()}")
+        reply = self._reply(timeout)
+        if reply.get('fatal'):
+            self.kill()
+        if not reply['ok']:
+            raise RenderError("worker could not render the formula", log=reply.get('log', '')[-4000:])
+
+    def kill(self):
+        _kill(self.proc)
+        self.proc.wait()
+
+    def close(self):
+        """Let the worker finish its loop; kill it if it does not exit promptly."""
+        try:
+            self.proc.stdin.close()
+            self.proc.wait(timeout=5)
+        except (OSError, subprocess.TimeoutExpired):
+            self.kill()
+
+
+_idle: list[_Worker] = []
+_idle_lock = threading.Lock()
+
+
+def _checkout() -> _Worker:
+    with _idle_lock:
+        while _idle:
+            worker = _idle.pop()
+            if worker.alive:
+                return worker
+    metrics.incr('latex.worker_started')
+    return _Worker()
+
+
+def _checkin(worker: _Worker):
+    # Recycled after LATEX_WORKER_MAX_JOBS so a slow leak in matplotlib cannot build up
+    if worker.alive and worker.jobs < config.LATEX_WORKER_MAX_JOBS:
+        with _idle_lock:
+            _idle.append(worker)
+    else:
+        worker.close()
+
+
+def worker_pids() -> list[int]:
+    """PIDs of the idle worker processes (all of them between renders)."""
+    with _idle_lock:
+        return [worker.proc.pid for worker in _idle if worker.alive]
+
+
+@atexit.register
+def shutdown_workers():
+    """Stop the idle workers (busy ones are stopped when their job returns)."""
+    with _idle_lock:
+        workers = _idle[:]
+        _idle.clear()
+    for worker in workers:
+        worker.close()
+
+
+def _run_worker(full_latex: str, output_path: str, usetex: bool, timeout: float):
+    job = {
+        'latex':       full_latex,
+        'output_path': output_path,
+        'usetex':      usetex,
+        'cpu_seconds': int(timeout) + 1,
+    }
+    queued = time.monotonic()
+    with _worker_slots:
+        metrics.observe('latex.worker_wait_seconds', time.monotonic() - queued)
+        worker = _checkout()
+        try:
+            worker.render(job, timeout)
+        finally:
+            _checkin(worker)
+
+
+# ── Render cache ─────────────────────────────────────────────────────────────
+def cache_path(full_latex: str, backend: str) -> str:
+    """Cache file for one wrapped formula rendered by `backend`."""
+    key = hashlib.sha256(
+        f"{CACHE_VERSION}\n{LATEX_PREAMBLE}\n{backend}\n{full_latex}".encode('utf-8')
+    ).hexdigest()
+    return str(config.FORMULA_CACHE_DIR / key[:2] / f"{key}.png")
+
+
+def _cache_get(full_latex: str, backend: str, output_path: str) -> bool:
+    try:
+        with open(cache_path(full_latex, backend), 'rb') as f:
+            data = f.read()
+    except OSError:
+        return False
+    _write_atomic(data, output_path)
+    return True
+
+
+def _cache_put(full_latex: str, backend: str, output_path: str):
+    # A cache problem must never fail a formula that did render
+    path = cache_path(full_latex, backend)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(output_path, 'rb') as f:
+            _write_atomic(f.read(), path)
+    except OSError as e:
+        logger.warning(f"[latex] could not cache {output_path}: {e}")
+
+
+def generate_latex_img(latex_code: str, output_path: str, inline: bool = False) -> str:
     """
-    Generates a PNG image from LaTeX code using Matplotlib's mathtext.
-    
+    Generates a PNG image from LaTeX code, trying usetex first and mathtext second.
+    A backend's cached PNG is used instead of rendering when there is one.
+
     Args:
-        latex_code: The LaTeX string (without $ if they are added here).
+        latex_code: The LaTeX string (without surrounding $).
         output_path: Path to save the PNG file.
         inline: If True, renders as inline math instead of displaystyle.
+
+    Returns:
+        The backend that succeeded ('usetex' or 'mathtext').
+
+    Raises:
+        RenderError: if the formula was rejected or no backend could render it.
     """
-    # Configure for high quality (300 DPI for Gmail-skärpa)
-    # Enable full LaTeX support for complex environments like pmatrix
-    plt.rc('text', usetex=True) 
-    plt.rc('text.latex', preamble=r'\usepackage{amsmath}')
-    plt.rc('font', family='serif')
-    
-    # Create figure with a small size, will be tight-boxed later
-    # We use a white background for the figure to help with light theme, 
-    # but keep the savefig transparent.
-    fig = plt.figure(figsize=(0.1, 0.1))
-    
-    # Handle delimiters smartly:
-    # If the AI uses a block environment, don't wrap it in $...$
-    if any(env in latex_code for env in [r"\begin{align", r"\begin{equation", r"\begin{gather", r"\begin{pmatrix"]):
-        full_latex = latex_code
-    else:
-        if inline:
-            full_latex = f"${latex_code}$"
-        else:
-            # Use displaystyle for full size sums/integrals even in simple lines
-            full_latex = f"$\\displaystyle {latex_code}$"
-    
-    # Render text. Using a larger fontsize helps with DPI clarity
-    plt.text(0, 0, full_latex, fontsize=14, color='black')
-    plt.axis('off')
-    
-    # Save the result with high DPI and transparent background
-    # We use bbox_inches='tight' to crop the image to the formula only
-    plt.savefig(output_path, bbox_inches='tight', pad_inches=0.05, dpi=150, transparent=True)
-    plt.close(fig)
+    try:
+        check_formula(latex_code)
+    except RenderError:
+        metrics.incr('latex.rejected')
+        raise
+
+    full_latex = wrap_formula(latex_code, inline)
+    backends = []
+    # mathtext has no environments – it would draw \begin{pmatrix} as plain text
+    if not any(env in latex_code for env in BLOCK_ENVS):
+        backends.append(('mathtext', config.LATEX_MATHTEXT_TIMEOUT))
+    if usetex_available():
+        backends.insert(0, ('usetex', config.LATEX_USETEX_TIMEOUT))
+
+    errors = []
+    for backend, timeout in backends:
+        latex = full_latex
+        if backend == 'mathtext':
+            # mathtext is always display-sized; it does not know \displaystyle
+            latex = latex.replace('\\displaystyle ', '')
+        if _cache_get(latex, backend, output_path):
+            metrics.incr('latex.cache_hit')
+            return backend
+
+        start = time.monotonic()
+        try:
+            _run_worker(latex, output_path, usetex=(backend == 'usetex'), timeout=timeout)
+        except RenderError as e:
+            kind = 'timeout' if isinstance(e, RenderTimeout) else 'failed'
+            metrics.incr(f'latex.{backend}.{kind}')
+            logger.warning(f"[latex] {backend} {kind}: {latex_code[:40]!r} – {e}")
+            errors.append((backend, e))
+            continue
+        finally:
+            metrics.observe('latex.render_seconds', time.monotonic() - start)
+        metrics.incr(f'latex.{backend}')
+        _cache_put(latex, backend, output_path)
+        return backend
+
+    metrics.incr('latex.text_fallback')
+    if not errors:
+        raise RenderError("no backend available for this formula")
+    # Keep every backend's log – the usetex error is usually the most telling one
+    raise RenderError(
+        "all backends failed: " + "; ".join(f"{b}: {e}" for b, e in errors),
+        log="\n".join(f"[{b}]\n{e.log}" for b, e in errors),
+    )
+
+
+# ── Warm-up ──────────────────────────────────────────────────────────────────
+WARM_SAMPLE = r"\mathbf{A}\mathbf{v} = \lambda \mathbf{v},\ \mathcal{L}\{f\}(s) = \int_0^\infty f(t)\,e^{-st}\,dt"
+WARM_SAMPLE_ENV = r"\begin{pmatrix} a & b \\ c & d \end{pmatrix}"
+
+
+def warm_up(formulas: list[tuple[str, bool]] = ()) -> list[tuple[str, float]]:
+    """
+    Pay the one-off costs of a fresh machine ahead of the real run: matplotlib's font
+    cache, mathtext fonts, the TeX format and cm-super fonts, a worker's start-up, and
+    the (latex, inline) `formulas` rendered into the formula cache. The caches persist
+    in .cache/ (`main.py --warm`); the started worker only serves later renders of this
+    process, so it is gone when the CLI exits. Returns (step, seconds) for every step that ran.
+    """
+    import concurrent.futures
+
+    steps = []
+
+    def _step(name: str, fn):
+        start = time.monotonic()
+        fn()
+        elapsed = time.monotonic() - start
+        steps.append((name, elapsed))
+        logger.info(f"[warm] {name}: {elapsed:.2f}s")
+
+    def _font_cache():
+        _init_matplotlib()
+        from matplotlib import font_manager
+        font_manager.findfont('serif')
+
+    _step('matplotlib font cache', _font_cache)
+    _step('mathtext fonts', lambda: render_png(f"${WARM_SAMPLE}$", usetex=False))
+    if usetex_available():
+        # First usetex call loads the LaTeX format and builds the fonts dvipng needs
+        _step('TeX format + cm-super fonts',
+              lambda: render_png(f"$\\displaystyle {WARM_SAMPLE} {WARM_SAMPLE_ENV}$", usetex=True))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        _step('worker start-up', lambda: _run_worker(
+            '$x^2$', os.path.join(tmp, 'warm.png'), usetex=False, timeout=config.LATEX_MATHTEXT_TIMEOUT
+        ))
+
+        def _render(job):
+            i, (latex, inline) = job
+            try:
+                generate_latex_img(latex, os.path.join(tmp, f"{i}.png"), inline=inline)
+            except RenderError:
+                pass    # counted in the latex.* metrics like any other failure
+
+        def _prerender():
+            with concurrent.futures.ThreadPoolExecutor(max_workers=config.LATEX_RENDER_THREADS) as pool:
+                list(pool.map(_render, enumerate(formulas)))
+
+        if formulas:
+            _step(f'formula cache ({len(formulas)} formulas)', _prerender)
+
+    return steps
+
+
+def stress_test(threads: int = 16, rounds: int = 8) -> bool:
+    """
+    Render a set of formulas from many threads at once (in this process, without workers)
+    and check that every PNG is byte-identical to the single-threaded result.
+    """
+    import concurrent.futures
+
+    usetex = usetex_available()
+    formulas = [
+        r"\nabla \times \mathbf{E} = -\frac{\partial \mathbf{B}}{\partial t}",
+        r"\int_a^b f(x)\,dx = F(b) - F(a)",
+        r"\sum_{k=0}^{n} \binom{n}{k} = 2^n",
+        r"P(A \mid B) = \frac{P(B \mid A)\,P(A)}{P(B)}",
+        r"\forall x\, (P(x) \rightarrow Q(x))",
+        r"x^2",
+    ]
+    jobs = [wrap_formula(f, inline=(i % 2 == 1)) for i, f in enumerate(formulas)]
+    if not usetex:
+        jobs = [j.replace('\\displaystyle ', '') for j in jobs]
+
+    expected = [render_png(j, usetex) for j in jobs]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as pool:
+        results = list(pool.map(lambda j: render_png(j, usetex), jobs * rounds))
+
+    mismatches = sum(png != expected[i % len(jobs)] for i, png in enumerate(results))
+    print(f"{len(results)} renders on {threads} threads ({'usetex' if usetex else 'mathtext'}): "
+          f"{mismatches} differ from single-threaded output")
+    return mismatches == 0
+
 
 if __name__ == "__main__":
+    if '--worker' in sys.argv:
+        sys.exit(_worker_main())
+
+    logging.basicConfig(level=logging.INFO)
+    if '--stress' in sys.argv:
+        sys.exit(0 if stress_test() else 1)
+
+    for bad in [r"\input{/etc/passwd}", r"\InputIfFileExists{/etc/passwd}{}{}", r"\verbatiminput{x}",
+                r"\makeatletter\@input{x}", r"\@@input{x}", r"\csname input\endcsname", r"^^5cinput"]:
+        try:
+            check_formula(bad)
+        except RenderError:
+            continue
+        raise AssertionError(f"check_formula let {bad!r} through")
+    check_formula(r"\frac{a}{b} + \mathbb{R}^n \mid \iint_D f\,dA")
+
     # Test
     test_code = r"\nabla \times \mathbf{E} = -\frac{\partial \mathbf{B}}{\partial t}"
-    generate_latex_img(test_code, "test_equation.png")
-    print("Test image generated: test_equation.png")
+    backend = generate_latex_img(test_code, "test_equation.png")
+    print(f"Test image generated with {backend}: test_equation.png")
@@ -0,0 +1,204 @@
+"""
+Length control for section generation.
+Each section's max_tokens is set from the word and token counts of its earlier
+generations instead of a flat 4096, and a streamed answer is cut off once it has both
+reached its target word count and finished a paragraph under its closing heading
+(config.SECTION_CLOSING_HEADING) – the model stops writing, and billing, right there
+instead of adding more.
+"""
+
+import re
+import math
+import logging
+import threading
+import statistics
+import contextvars
+from contextlib import contextmanager
+from typing import Optional, Sequence
+
+import config
+from utils import metrics
+from utils.hedging import percentile
+
+logger = logging.getLogger(__name__)
+
+CLOSING = re.compile(rf'^#{{2,3}}\s*{re.escape(config.SECTION_CLOSING_HEADING)}\b.*$', re.MULTILINE)
+PARAGRAPH = re.compile(r'\S.*?\n[ \t]*\n', re.DOTALL)
+
+# Target of the section generated in the current thread/context, if any
+_target: contextvars.ContextVar[Optional['LengthTarget']] = contextvars.ContextVar('length_target', default=None)
+# Text streamed so far by the call running in the current context
+_streamed: contextvars.ContextVar[Optional[list]] = contextvars.ContextVar('length_streamed', default=None)
+
+
+def output_budget(history: Sequence[tuple], target_words: int) -> int:
+    """
+    max_tokens for a section from its recent (words, output_tokens) pairs: the larger of
+    the target and the p90 word count, at the median tokens per word, plus headroom.
+    The default budget until there are LENGTH_MIN_SAMPLES complete samples.
+    """
+    samples = [(w, t) for w, t in history if w and t]
+    if len(samples) < config.LENGTH_MIN_SAMPLES:
+        return config.LENGTH_DEFAULT_MAX_TOKENS
+    tokens_per_word = statistics.median(t / w for w, t in samples)
+    words = max(target_words, percentile([w for w, _ in samples], 90))
+    budget = math.ceil(words * tokens_per_word * config.LENGTH_HEADROOM) + config.LENGTH_OVERHEAD_TOKENS
+    return max(config.LENGTH_MIN_TOKENS, min(budget, config.LENGTH_DEFAULT_MAX_TOKENS))
+
+
+class LengthTarget:
+    """
+    Target word count of a generation, and the event that cancels it (e.g. a hedged
+    request that lost). Afterwards `output_tokens` holds the output tokens reported by
+    its LLM calls and `stopped` tells whether a stream was cut short.
+    """
+
+    def __init__(self, words: Optional[int], cancel: Optional[threading.Event] = None):
+        self.words = words
+        self.cancel = cancel
+        self.output_tokens = 0
+        self.stopped = False
+
+    @property
+    def cancelled(self) -> bool:
+        return self.cancel is not None and self.cancel.is_set()
+
+
+@contextmanager
+def length_target(words: Optional[int], cancel: Optional[threading.Event] = None):
+    """
+    Stop streamed answers generated inside this block at the first paragraph end under
+    their closing heading with at least `words` words, the length the task asked for
+    (None: never stop). Once `cancel` is set,
+    LLM calls inside the block raise Cancelled – a running stream at its next chunk.
+    Yields the LengthTarget.
+    """
+    target = LengthTarget(words, cancel)
+    token = _target.set(target)
+    try:
+        yield target
+    finally:
+        _target.reset(token)
+
+
+def cut_point(text: str, words: int) -> Optional[int]:
+    """
+    Where to end a streamed answer: after the first complete paragraph under the closing
+    heading of the answer (after crewai's 'Final Answer:') by which the answer has at
+    least `words` words. None while there is none yet.
+    """
+    body = text.rsplit('Final Answer:', 1)[-1]
+    offset = len(text) - len(body)
+    heading = CLOSING.search(body)
+    if heading is None:
+        return None
+    for paragraph in PARAGRAPH.finditer(body, heading.end()):
+        if len(body[:paragraph.end()].split()) >= words:
+            return offset + paragraph.end()
+    return None
+
+
+class _EnoughText(BaseException):
+    """
+    Ends a stream from inside the chunk callback. A BaseException, so crewai's error
+    logging and retries let it pass and the stream's context manager closes the request.
+    """
+
+    def __init__(self, text: str):
+        super().__init__("target length reached")
+        self.text = text
+
+
+class Cancelled(BaseException):
+    """
+    An LLM call whose LengthTarget was cancelled. A BaseException, so it passes crewai's
+    error handling and retries and ends the whole crew; `text` is what was streamed.
+    """
+
+    def __init__(self, text: str = ''):
+        super().__init__("generation cancelled")
+        self.text = text
+
+
+class LengthGuarded:
+    """
+    Mixin for a crewai LLM class: stops its streams (stream=True) at the current target
+    and counts its output tokens towards it (main.llm_class()).
+    """
+
+    def call(self, messages, *args, **kwargs):
+        target = _target.get()
+        if target is not None and target.cancelled:
+            raise Cancelled()
+        if target is None or not getattr(self, 'stream', False):
+            return super().call(messages, *args, **kwargs)
+        token = _streamed.set([])
+        try:
+            return super().call(messages, *args, **kwargs)
+        except _EnoughText as stop:
+            target.stopped = True
+            metrics.incr('length.stopped_early')
+            logger.debug(f"Stream stopped in its closing section at "
+                         f"{len(stop.text.split())} words (target {target.words})")
+            return stop.text
+        finally:
+            _streamed.reset(token)
+
+    def _emit_stream_chunk_event(self, chunk, *args, **kwargs):
+        super()._emit_stream_chunk_event(chunk, *args, **kwargs)
+        chunks, target = _streamed.get(), _target.get()
+        if chunks is None or target is None or not chunk or kwargs.get('tool_call'):
+            return
+        chunks.append(chunk)
+        if target.cancelled:
+            raise Cancelled(''.join(chunks))
+        if target.words is None:
+            return
+        # A paragraph can only have ended on a chunk with a blank line
+        if '\n' in chunk:
+            text = ''.join(chunks)
+            cut = cut_point(text, target.words)
+            if cut is not None:
+                raise _EnoughText(text[:cut].rstrip())
+
+    def _track_token_usage_internal(self, usage_data: dict):
+        target = _target.get()
+        if target is not None:
+            target.output_tokens += usage_data.get('output_tokens', 0) or 0
+        super()._track_token_usage_internal(usage_data)
+
+
+if __name__ == '__main__':
+    # Self-test: a streamed fake answer that goes on after its closing paragraph, cut at
+    # that paragraph when it reaches the target and further on when it falls short
+    import time
+    from utils.fake_llm import FakeLLM
+
+    answer = (
+        "TOPIC: Test\n\n## Test\n\n" + "ord " * 480 + "\n\n"
+        f"### {config.SECTION_CLOSING_HEADING}\n\nEn kort avslutning med några ord till.\n\n"
+        + "Ytterligare ett stycke som inte behövs.\n\n" * 100
+    )
+
+    class GuardedFakeLLM(LengthGuarded, FakeLLM):
+        pass
+
+    closing = "En kort avslutning med några ord till."
+    assert cut_point(answer[:answer.index(closing) + 10], 400) is None    # closing paragraph not finished
+    assert answer[:cut_point(answer, 400)].rstrip().endswith(closing)
+    short = answer[:cut_point(answer, 500)]
+    assert short.rstrip().endswith("behövs.") and 500 <= len(short.split()) < 510   # closing came below the target
+
+    llm = GuardedFakeLLM(delays=[2.0], answer=answer, stream=True)
+    start = time.monotonic()
+    with length_target(500) as target:
+        text = llm.call("skriv")
+    elapsed = time.monotonic() - start
+    assert target.stopped and 500 <= len(text.split()) < 510, text[-80:]
+    assert elapsed < 1.5, elapsed
+    print(f"{len(answer.split())} words offered, {len(text.split())} kept in {elapsed:.2f}s; "
+          f"ends with {text[-40:]!r}")
+
+    budget = output_budget([(520, 1100), (540, 1150), (610, 1300), (500, 1050), (480, 1000)], 500)
+    assert config.LENGTH_MIN_TOKENS <= budget <= config.LENGTH_DEFAULT_MAX_TOKENS
+    print(f"budget for 500 words: {budget} tokens")
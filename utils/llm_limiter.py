@@ -0,0 +1,255 @@
+"""
+Client-side rate limiting for every LLM call in the process.
+One shared limiter sits in front of all section crews, hedged requests and formula
+repairs. It keeps requests, input tokens and output tokens per minute inside token
+buckets and adapts the number of concurrent requests AIMD-style: +1 per window of
+successful calls, halved on a 429/529. A throttled request waits for the server's
+retry-after and is retried instead of failing the section.
+
+The limiter replaces the SDK's and crewai's own retries, which would otherwise hide
+throttling from it: get_llm() builds the client with max_retries=0, and crewai's loop is
+switched off per call through its own retry flag.
+"""
+
+import time
+import logging
+import threading
+from functools import lru_cache
+from typing import Any, Callable, Optional
+
+import config
+from utils import metrics
+
+logger = logging.getLogger(__name__)
+
+THROTTLE_STATUS  = (429, 529)                  # rate limited, overloaded: back off and shrink concurrency
+TRANSIENT_STATUS = (408, 409, 500, 502, 503, 504)  # retried with backoff, as the SDK would
+TRANSIENT_ERRORS = ('APIConnectionError', 'APITimeoutError')
+
+
+class TokenBucket:
+    """
+    Refills continuously at `per_minute` per minute, holding at most one minute's worth.
+    Taking may put the bucket in debt; the caller then waits until the debt is paid off.
+    """
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate     = per_minute / 60
+        self.tokens   = per_minute
+        self.updated  = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, n: float, now: float) -> float:
+        """Take `n` tokens; returns the seconds to wait before using them."""
+        self._refill(now)
+        self.tokens -= min(n, self.capacity)
+        return max(0.0, -self.tokens / self.rate)
+
+    def give_back(self, n: float):
+        """Return `n` unused tokens (or charge more, if negative)."""
+        self.tokens = min(self.capacity, self.tokens + n)
+
+
+def _status(error: Exception) -> Optional[int]:
+    return getattr(error, 'status_code', None) or getattr(getattr(error, 'response', None), 'status_code', None)
+
+
+def _transient(error: Exception) -> bool:
+    return _status(error) in TRANSIENT_STATUS or type(error).__name__ in TRANSIENT_ERRORS
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    headers = getattr(getattr(error, 'response', None), 'headers', None) or {}
+    try:
+        return float(headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
+
+
+class LLMLimiter:
+    def __init__(self, rpm: float, input_tpm: float, output_tpm: float,
+                 concurrency: int, max_concurrency: int, max_retries: int):
+        self.requests      = TokenBucket(rpm)
+        self.input_tokens  = TokenBucket(input_tpm)
+        self.output_tokens = TokenBucket(output_tpm)
+        self.limit           = float(concurrency)
+        self.max_concurrency = max_concurrency
+        self.max_retries     = max_retries
+        self.in_flight     = 0
+        self.blocked_until = 0.0
+        self._cond = threading.Condition()
+
+    def _admit(self, input_est: int, output_est: int):
+        """Block until a concurrency slot is free and the buckets allow the request."""
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    self._cond.wait(self.blocked_until - now)
+                elif self.in_flight >= int(self.limit):
+                    self._cond.wait()
+                else:
+                    break
+            self.in_flight += 1
+            wait = max(
+                self.requests.take(1, now),
+                self.input_tokens.take(input_est, now),
+                self.output_tokens.take(output_est, now),
+            )
+        if wait > 0:
+            time.sleep(wait)
+
+    def _release(self, throttled: bool = False, retry_after: float = 0.0, ok: bool = False):
+        with self._cond:
+            self.in_flight -= 1
+            if throttled:
+                self.limit = max(1.0, self.limit / 2)
+                self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+                metrics.observe('llm.concurrency_limit', self.limit)
+            elif ok:
+                self.limit = min(float(self.max_concurrency), self.limit + 1 / self.limit)
+            self._cond.notify_all()
+
+    def call(self, fn: Callable[[], Any], input_est: int, output_est: int) -> Any:
+        """
+        Run `fn` (one LLM request) under the limits, retrying throttled requests.
+        Token estimates are corrected with the real usage when the LLM class reports it.
+        """
+        for attempt in range(self.max_retries + 1):
+            queued = time.monotonic()
+            self._admit(input_est, output_est)
+            start = time.monotonic()
+            metrics.observe('llm.queued_seconds', start - queued)
+            _usage.value = None
+            try:
+                result = fn()
+            except Exception as e:
+                metrics.observe('llm.generating_seconds', time.monotonic() - start)
+                throttled = _status(e) in THROTTLE_STATUS
+                if not (throttled or _transient(e)) or attempt == self.max_retries:
+                    self._release()
+                    raise
+                # A rejected request used no tokens
+                with self._cond:
+                    self.input_tokens.give_back(input_est)
+                    self.output_tokens.give_back(output_est)
+                wait = _retry_after(e) or 2 ** attempt
+                if throttled:
+                    self._release(throttled=True, retry_after=wait)
+                    metrics.incr('llm.throttled')
+                    logger.warning(
+                        f"[llm] Throttled ({_status(e)}) – retrying in {wait:g}s, "
+                        f"concurrency limit now {int(self.limit)}"
+                    )
+                else:
+                    self._release()
+                    metrics.incr('llm.retried')
+                    logger.warning(f"[llm] {type(e).__name__} – retrying in {wait:g}s")
+                    time.sleep(wait)
+                continue
+            except BaseException as e:
+                # Stopped from inside the call (a cancelled hedge): free the slot and the
+                # output tokens it did not get to use
+                used_out = len(getattr(e, 'text', '') or '') // 4
+                metrics.incr('llm.output_tokens', used_out)
+                with self._cond:
+                    self.output_tokens.give_back(output_est - used_out)
+                self._release()
+                raise
+
+            metrics.observe('llm.generating_seconds', time.monotonic() - start)
+            metrics.incr('llm.requests')
+            usage = _usage.value or {}
+            used_in  = usage.get('input_tokens', input_est)
+            used_out = usage.get('output_tokens', len(str(result)) // 4)
+            metrics.incr('llm.input_tokens', used_in)
+            metrics.incr('llm.output_tokens', used_out)
+            with self._cond:
+                self.input_tokens.give_back(input_est - used_in)
+                self.output_tokens.give_back(output_est - used_out)
+            self._release(ok=True)
+            return result
+
+
+limiter = LLMLimiter(
+    rpm=config.LLM_REQUESTS_PER_MINUTE,
+    input_tpm=config.LLM_INPUT_TOKENS_PER_MINUTE,
+    output_tpm=config.LLM_OUTPUT_TOKENS_PER_MINUTE,
+    concurrency=config.LLM_CONCURRENCY_START,
+    max_concurrency=config.LLM_CONCURRENCY_MAX,
+    max_retries=config.LLM_MAX_RETRIES,
+)
+
+# Token usage of the request running in this thread, reported by the LLM class
+_usage = threading.local()
+
+
+@lru_cache(maxsize=None)
+def _crewai_retry_flag():
+    """
+    The context variable crewai's retry loop checks to see whether it is already inside
+    a retry (a private hook, hence the check). None, with a warning, if it is gone.
+    """
+    try:
+        from crewai.llms.retry import _active_llm_rate_limit_retry
+    except ImportError:
+        logger.warning("crewai's rate-limit retry hook not found – its own 429 retries "
+                       "now run inside the limiter and hide throttling from it")
+        return None
+    return _active_llm_rate_limit_retry
+
+
+def _without_crewai_retry(fn, *args, **kwargs):
+    """
+    crewai wraps every LLM call in its own 429 retry loop, which would hide throttling
+    from the limiter. Its loop is skipped when it believes it is already retrying.
+    """
+    active = _crewai_retry_flag()
+    if active is None:
+        return fn(*args, **kwargs)
+    token = active.set(True)
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        active.reset(token)
+
+
+class Limited:
+    """
+    Mixin for a crewai LLM class: every call goes through `limiter`. Put it first in the
+    bases of the class the LLM is created with (main.llm_class()).
+    """
+
+    def call(self, messages, *args, **kwargs):
+        input_est  = len(str(messages)) // 4
+        output_est = getattr(self, 'max_tokens', None) or 4096
+        return limiter.call(
+            lambda: _without_crewai_retry(super(Limited, self).call, messages, *args, **kwargs),
+            input_est, output_est,
+        )
+
+    def _track_token_usage_internal(self, usage_data: dict):
+        _usage.value = usage_data
+        super()._track_token_usage_internal(usage_data)
+
+
+if __name__ == '__main__':
+    # Self-test: 12 concurrent calls to a fake LLM whose first two requests are throttled
+    import concurrent.futures
+    from utils.fake_llm import FakeLLM
+
+    logging.basicConfig(level=logging.INFO)
+    class LimitedFakeLLM(Limited, FakeLLM):
+        pass
+
+    llm = LimitedFakeLLM(delays=[0.2], answer='ok', throttled_calls=2, max_tokens=512)
+    start = time.monotonic()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=12) as pool:
+        results = list(pool.map(lambda i: llm.call(f"fråga {i}"), range(12)))
+    print(f"{results.count('ok')}/12 ok in {time.monotonic() - start:.2f}s, "
+          f"concurrency limit {limiter.limit:.2f}")
+    metrics.log_summary()
@@ -0,0 +1,101 @@
+"""
+Logging for Repetitionsmail.
+Records are handed to a QueueHandler and written by a QueueListener thread, so file
+I/O never runs on the generation threads. The file log is rotated, one compact JSON
+object per line; the console keeps the readable text format. Verbosity is set per
+subsystem (logger name) in config.LOG_LEVELS or the LOG_LEVELS environment variable.
+"""
+
+import os
+import json
+import time
+import queue
+import atexit
+import shutil
+import logging
+import logging.handlers
+from datetime import datetime, timezone
+
+import config
+
+# Attributes every LogRecord has; anything else was passed with `extra=` and is logged as a field
+_STANDARD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+_listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One compact JSON object per record: time, level, logger, message and any `extra` fields.
+    QueueHandler has already folded a traceback into the message.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            't':   datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'lvl': record.levelname,
+            'log': record.name,
+            'msg': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _STANDARD_ATTRS and not key.startswith('_'):
+                entry[key] = value
+        return json.dumps(entry, ensure_ascii=False, default=str, separators=(',', ':'))
+
+
+def log_levels() -> dict:
+    """config.LOG_LEVELS, overridden by LOG_LEVELS="name=LEVEL,name=LEVEL" from the environment."""
+    levels = dict(config.LOG_LEVELS)
+    for item in os.getenv('LOG_LEVELS', '').split(','):
+        name, sep, level = item.partition('=')
+        if sep:
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def setup_logging():
+    """Install the queue-based handlers on the root logger (once per process)."""
+    global _listener
+    if _listener is not None:
+        return
+
+    file_handler = logging.handlers.RotatingFileHandler(
+        config.LOG_DIR / 'repetitionsmail.log',
+        maxBytes=config.LOG_MAX_BYTES, backupCount=config.LOG_BACKUPS, encoding='utf-8',
+    )
+    file_handler.setFormatter(JsonFormatter())
+    console = logging.StreamHandler()
+    console.setFormatter(logging.Formatter('%(asctime)s  %(levelname)-8s  %(message)s'))
+
+    records = queue.SimpleQueue()
+    _listener = logging.handlers.QueueListener(records, file_handler, console, respect_handler_level=True)
+    _listener.start()
+    # Flush what is still queued when the process ends
+    atexit.register(_listener.stop)
+
+    root = logging.getLogger()
+    root.handlers[:] = [logging.handlers.QueueHandler(records)]
+    for name, level in log_levels().items():
+        logging.getLogger(name or None).setLevel(level)
+
+
+def prune_logs(keep_days: int = config.LOG_KEEP_DAYS):
+    """Delete formula render directories and HTML previews older than `keep_days` days."""
+    cutoff = time.time() - keep_days * 86400
+    removed = 0
+    paths = list(config.LOG_DIR.glob('preview_*.html'))
+    if config.RENDER_DIR.exists():
+        paths += [p for p in config.RENDER_DIR.iterdir() if p.is_dir()]
+    for path in paths:
+        try:
+            if path.stat().st_mtime >= cutoff:
+                continue
+            if path.is_dir():
+                shutil.rmtree(path)
+            else:
+                path.unlink()
+            removed += 1
+        except OSError as e:
+            logging.getLogger(__name__).warning(f"Could not prune {path}: {e}")
+    if removed:
+        logging.getLogger(__name__).info(f"Pruned {removed} old render directories/previews from {config.LOG_DIR}")
@@ -0,0 +1,51 @@
+"""
+Run metrics for Repetitionsmail.
+Thread-safe counters and samples collected during a run and logged when it ends.
+"""
+
+import logging
+import threading
+from collections import Counter, defaultdict
+
+logger = logging.getLogger(__name__)
+
+_lock     = threading.Lock()
+_counters = Counter()
+_samples  = defaultdict(list)
+
+
+def incr(name: str, n: int = 1):
+    """Increase the counter `name` by `n`."""
+    with _lock:
+        _counters[name] += n
+
+
+def observe(name: str, value: float):
+    """Record one sample (a duration in seconds, a size in bytes, …) under `name`."""
+    with _lock:
+        _samples[name].append(value)
+
+
+def snapshot() -> dict:
+    """Return a copy of all counters and samples collected so far."""
+    with _lock:
+        return {
+            'counters': dict(_counters),
+            'samples':  {k: list(v) for k, v in _samples.items()},
+        }
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _samples.clear()
+
+
+def log_summary():
+    snap = snapshot()
+    for name, count in sorted(snap['counters'].items()):
+        logger.info(f"[metrics] {name} = {count}")
+    for name, values in sorted(snap['samples'].items()):
+        logger.info(
+            f"[metrics] {name}: n={len(values)} total={sum(values):.2f} max={max(values):.2f}"
+        )